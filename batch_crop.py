@@ -0,0 +1,325 @@
+"""Headless batch cropping.
+
+Crop a list of positions out of one or more images, apply the same filters as the
+viewer and write the crops with a pool of worker processes. Does not import Qt, so it
+runs on machines without a display.
+
+Example:
+    python batch_crop.py scan1.tif scan2.tif --coords points.csv --size 256 \
+        --output crops --filter Grayscale --filter "Gaussian Blur"
+
+Image lists can be passed from a file with ``@images.txt`` (one path per line). With
+``--decode-cache DIR`` decoded images are kept in DIR and mapped on the next run.
+
+``--format`` and ``--level`` choose the output encoder; ``--measure-formats`` prints the
+encode time and size of every format on the first crops instead of writing them. With
+``--archive`` the crops are appended to tar shards in the output folder (see crop_archive).
+Every crop is recorded in the ``manifest.jsonl`` of the output folder (see crop_manifest).
+
+``--grid STRIDE`` replaces ``--coords`` and crops every window of a grid over the whole
+image, streaming the windows so memory stays flat on images larger than RAM.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+
+from crop_archive import CropArchive
+from crop_manifest import CropManifest, chain_description, image_key
+from cropping import CROP_FORMATS, CropEncoder, compare_encoders, crop_bounds, crop_file_name, write_crop_batch
+from decode_cache import DecodeCache
+from filters import FilterChain, filter_by_name
+from image_source import ImageSource, set_spill_dir
+
+
+def load_coordinates(coords_path):
+    """Read crop centres from a CSV or JSON file.
+
+    CSV files need ``x`` and ``y`` columns. JSON files hold a list of ``[x, y]`` pairs or
+    of objects with ``x`` and ``y`` keys. Both may give an optional ``image`` (path or
+    file name) to restrict a position to one image.
+
+    Returns a list of (image, x, y) tuples, image is None when it applies to all images.
+    """
+    coordinates = []
+    if coords_path.lower().endswith('.json'):
+        with open(coords_path) as f:
+            entries = json.load(f)
+        for entry in entries:
+            if isinstance(entry, dict):
+                coordinates.append((entry.get('image'), int(entry['x']), int(entry['y'])))
+            else:
+                coordinates.append((None, int(entry[0]), int(entry[1])))
+    else:
+        with open(coords_path, newline='') as f:
+            for row in csv.DictReader(f):
+                coordinates.append((row.get('image') or None, int(row['x']), int(row['y'])))
+    return coordinates
+
+
+def positions_for_image(image_path, coordinates):
+    """Return the distinct (x, y) positions that apply to the given image, in file order."""
+    positions = {}
+    for image, x, y in coordinates:
+        if image is None or image == image_path or image == os.path.basename(image_path):
+            # A repeated position would overwrite its own crop
+            positions[x, y] = None
+    return list(positions)
+
+
+def check_crop_names(image_paths):
+    """Return the distinct image paths, raising ValueError if their crops would share names.
+
+    Crop names only keep the file name of the image without its extension (see
+    crop_file_name), so ``a.png`` and ``a.jpg``, or ``d1/a.tif`` and ``d2/a.tif``,
+    would overwrite each other's crops.
+    """
+    images = {}  # Crop name stem -> image path
+    distinct = []
+    for image_path in image_paths:
+        stem = os.path.splitext(os.path.basename(image_path))[0]
+        other = images.get(stem)
+        if other is None:
+            images[stem] = image_path
+            distinct.append(image_path)
+        elif os.path.abspath(other) != os.path.abspath(image_path):
+            raise ValueError(f"{other} and {image_path} would write crops with the same names; "
+                             "crop them into separate output folders")
+    return distinct
+
+
+def grid_axes(image_size, crop_size, stride, region=None):
+    """Return the ranges of window left and top edges tiling a region of the image.
+
+    region is (x, y, width, height), the whole image by default. Only windows that
+    fit entirely in the region are kept.
+    """
+    height, width = image_size
+    x, y, region_width, region_height = region or (0, 0, width, height)
+    x_end = min(width, x + region_width)
+    y_end = min(height, y + region_height)
+    x, y = max(0, x), max(0, y)
+    return range(x, x_end - crop_size + 1, stride), range(y, y_end - crop_size + 1, stride)
+
+
+def grid_positions(image_size, crop_size, stride, region=None):
+    """Yield the (x, y) left and top edges of a grid of crop_size windows, row by row (see grid_axes)."""
+    x_starts, y_starts = grid_axes(image_size, crop_size, stride, region)
+    for y in y_starts:
+        for x in x_starts:
+            yield x, y
+
+
+def chunked(iterable, size):
+    """Yield lists of up to size items of an iterable, consuming it lazily."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def read_crops(image_source, positions, crop_size):
+    """Read the crops centred on positions; returns the crops and their (x, y) centres."""
+    crops = []
+    centres = []
+    for x, y in positions:
+        x_start, y_start, x_end, y_end = crop_bounds(x, y, crop_size, image_source.shape)
+        crop = image_source.read_region(x_start, y_start, x_end - x_start, y_end - y_start)
+        if crop.size == 0:
+            continue
+        crops.append(crop)
+        centres.append((x, y))
+    return crops, centres
+
+
+def read_windows(image_source, windows, crop_size):
+    """Read the crop_size windows at (x, y) left and top edges; returns the crops and their centres.
+
+    Unlike read_crops the windows keep their full size when crop_size is odd, so a grid
+    with a stride of crop_size tiles the image without gaps.
+    """
+    half = crop_size // 2
+    crops = [image_source.read_region(x, y, crop_size, crop_size) for x, y in windows]
+    return crops, [(x + half, y + half) for x, y in windows]
+
+
+class _CollectSink:
+    """Keeps the encoded crops of a worker, to be archived by the parent process."""
+    def __init__(self):
+        self.crops = []
+
+    def write(self, name, data):
+        self.crops.append((name, data))
+
+
+def crop_chunk(image_path, pixels_path, positions, crop_size, filters, output_folder, encoder=None,
+               collect=False, grid=False):
+    """Crop and write a chunk of positions of one image (runs in a worker process).
+
+    positions are crop centres, or with grid the window edges of grid_positions.
+    filters are filter names or Filter objects. Returns the manifest records of the
+    crops, for the parent to add to the manifest of the output folder, and with collect
+    the (name, bytes) of the encoded crops, for the parent to write to an archive
+    (None otherwise).
+    """
+    # The parent decoded the image once; workers map the same pixels from disk
+    image_source = ImageSource(pixels_path)
+    filter_chain = FilterChain([filter_by_name(f) if isinstance(f, str) else f for f in filters])
+    encoder = encoder or CropEncoder()
+    sink = _CollectSink() if collect else None
+    if grid:
+        crops, centres = read_windows(image_source, positions, crop_size)
+    else:
+        crops, centres = read_crops(image_source, positions, crop_size)
+    records = []
+    if crops:
+        crop_names = [crop_file_name(image_path, x, y, encoder.extension) for x, y in centres]
+        crop_paths = [os.path.join(output_folder, crop_name) for crop_name in crop_names]
+        # Filter the chunk as one stack so the time is spent in OpenCV, not per crop
+        write_crop_batch(crops, filter_chain, crop_paths, encoder, sink)
+        key = image_key(image_path)
+        filter_names = chain_description(filter_chain)
+        for crop, crop_name, (x, y) in zip(crops, crop_names, centres):
+            crop_key = CropManifest.key(key, x, y, crop_size, filter_names, encoder)
+            records.append(CropManifest.entry(crop_key, crop_name, image_path, crop))
+    return records, sink.crops if collect else None
+
+
+def measure_formats(image_paths, coordinates, crop_size, filter_names, sample_size=64, grid_stride=None):
+    """Print the encode time and size of every format on filtered crops of the first image."""
+    for image_path in image_paths:
+        if grid_stride is not None:
+            break
+        positions = positions_for_image(image_path, coordinates)[:sample_size]
+        if positions:
+            break
+    else:
+        raise ValueError("No positions to measure")
+    image_source = ImageSource(image_path)
+    if grid_stride is not None:
+        windows = list(islice(grid_positions(image_source.shape, crop_size, grid_stride), sample_size))
+        crops = read_windows(image_source, windows, crop_size)[0]
+    else:
+        crops = read_crops(image_source, positions, crop_size)[0]
+    filter_chain = FilterChain([filter_by_name(name) for name in filter_names])
+    crops = [filter_chain.apply(crop) for crop in crops]
+    image_source.close()
+    if not crops:
+        raise ValueError("No crops to measure")
+
+    print(f"{len(crops)} crops of {os.path.basename(image_path)}")
+    print(f"{'format':12s} {'ms/crop':>9s} {'KB/crop':>9s}")
+    for encoder, milliseconds, size in compare_encoders(crops):
+        print(f"{str(encoder):12s} {milliseconds:9.2f} {size / 1024:9.1f}")
+
+
+def run(image_paths, coordinates, crop_size, filter_names, output_folder, workers=None, chunk_size=64,
+        decode_cache=None, encoder=None, archive=False, grid_stride=None):
+    """Crop every image at its positions, or on a grid; returns the number of crops written."""
+    # Fail early on unknown filter names and on images whose crops would overwrite each other
+    for name in filter_names:
+        filter_by_name(name)
+    image_paths = check_crop_names(image_paths)
+    os.makedirs(output_folder, exist_ok=True)
+    # Workers send their crops and records back and only this process appends to the
+    # archive and the manifest
+    crop_archive = CropArchive(output_folder) if archive else None
+    manifest = CropManifest(output_folder)
+
+    def collect(futures):
+        count = 0
+        for future in futures:
+            records, crops = future.result()
+            for name, data in crops or ():
+                crop_archive.write(name, data)
+            manifest.add_all(records)
+            count += len(records)
+        return count
+
+    written = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Only a few chunks are in flight, so grids of millions of windows stream through
+        max_pending = 2 * (workers or os.cpu_count() or 1)
+        for image_path in image_paths:
+            if grid_stride is None:
+                positions = positions_for_image(image_path, coordinates)
+                if not positions:
+                    continue
+            image_source = ImageSource(image_path, cache=decode_cache)
+            if grid_stride is not None:
+                positions = grid_positions(image_source.shape, crop_size, grid_stride)
+            pending = set()
+            for chunk in chunked(positions, chunk_size):
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    written += collect(done)
+                pending.add(executor.submit(crop_chunk, image_path, image_source.pixels_path, chunk, crop_size,
+                                            filter_names, output_folder, encoder, archive,
+                                            grid_stride is not None))
+            # Keep the decoded pixels alive until every chunk of this image is done
+            written += collect(wait(pending).done)
+            image_source.close()
+    if crop_archive is not None:
+        crop_archive.close()
+    manifest.close()
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Crop images at the given positions without the GUI.",
+                                     fromfile_prefix_chars='@')
+    parser.add_argument('images', nargs='+', help="Images to crop (use @file to read a list)")
+    positions_group = parser.add_mutually_exclusive_group(required=True)
+    positions_group.add_argument('--coords', help="CSV or JSON file with the crop centres")
+    positions_group.add_argument('--grid', type=int, metavar='STRIDE',
+                                 help="Crop every window of a grid with this stride in pixels instead")
+    parser.add_argument('--size', type=int, default=100, help="Crop size in pixels (default: 100)")
+    parser.add_argument('--output', help="Destination folder for the crops")
+    parser.add_argument('--filter', dest='filters', action='append', default=[],
+                        help="Filter to apply, by name; repeat to chain filters in order")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument('--decode-cache', help="Folder to keep decoded images in between runs")
+    parser.add_argument('--spill-dir',
+                        help="Folder for the decoded pixels of the images (default: the temporary folder)")
+    parser.add_argument('--format', choices=list(CROP_FORMATS), default='PNG',
+                        help="Crop file format (default: PNG)")
+    parser.add_argument('--level', type=int, default=None,
+                        help="PNG compression (0-9), JPEG quality (0-100) or WebP quality (1-101, lossless above 100)")
+    parser.add_argument('--archive', action='store_true',
+                        help="Append the crops to tar shards with an index instead of one file per crop")
+    parser.add_argument('--measure-formats', action='store_true',
+                        help="Print the encode time and size of every format instead of writing crops")
+    args = parser.parse_args(argv)
+    if args.output is None and not args.measure_formats:
+        parser.error("the following arguments are required: --output")
+
+    coordinates = load_coordinates(args.coords) if args.coords else None
+    decode_cache = DecodeCache(args.decode_cache) if args.decode_cache else None
+    if args.spill_dir:
+        set_spill_dir(args.spill_dir)
+    start = time.perf_counter()
+    try:
+        if args.measure_formats:
+            measure_formats(args.images, coordinates, args.size, args.filters, grid_stride=args.grid)
+            return 0
+        encoder = CropEncoder(args.format, args.level)
+        written = run(args.images, coordinates, args.size, args.filters, args.output, args.workers,
+                      decode_cache=decode_cache, encoder=encoder, archive=args.archive, grid_stride=args.grid)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - start
+
+    rate = written / elapsed if elapsed > 0 else 0.0
+    print(f"Wrote {written} crops in {elapsed:.2f} s ({rate:.1f} crops/s)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
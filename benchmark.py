@@ -0,0 +1,245 @@
+"""Benchmarks for the viewer, mini-map, crop and filter hot paths.
+
+Runs headless with the offscreen Qt platform on synthetic images and saves the timings
+as JSON, so two commits can be compared:
+
+    python benchmark.py --sizes 1 16 100 --output before.json
+    (check out the other commit)
+    python benchmark.py --sizes 1 16 100 --output after.json
+    python benchmark.py --compare before.json after.json
+
+Sizes are in megapixels; 1000 (one gigapixel) needs about 3 GB of free disk space.
+Each size runs in its own process so the recorded peak RSS belongs to that size only.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None if unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def make_synthetic_image(path, megapixels, tile=1024):
+    """Write a (height, width, 3) uint8 .npy image of about the given size, in strips."""
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = int(megapixels * 1e6 / width)
+    image = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=(height, width, 3))
+    rng = np.random.default_rng(0)
+    # A gradient with noise, so filters and encoders do realistic work
+    x_ramp = (np.arange(width) * 255 // max(1, width - 1)).astype(np.uint8)
+    for y_start in range(0, height, tile):
+        y_end = min(height, y_start + tile)
+        strip = rng.integers(0, 64, size=(y_end - y_start, width, 3), dtype=np.uint8)
+        strip[:, :, 0] += x_ramp[None, :] // 2
+        strip[:, :, 1] += np.uint8(y_start * 127 // max(1, height))
+        image[y_start:y_end] = strip
+    image.flush()
+    del image
+    return height, width
+
+
+def timed(function, repeats):
+    """Run function repeats times and return timing statistics in milliseconds."""
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        'median_ms': statistics.median(samples),
+        'min_ms': min(samples),
+        'max_ms': max(samples),
+        'repeats': repeats,
+    }
+
+
+def run_size(megapixels, repeats):
+    """Benchmark one image size in this process and return its results."""
+    from PyQt5.QtCore import Qt, QEvent, QSettings, QStandardPaths
+    from PyQt5.QtGui import QKeyEvent
+    from PyQt5.QtWidgets import QApplication
+
+    work_dir = tempfile.mkdtemp(prefix='imagecropper_bench_')
+    # Keep the benchmark out of the user's recent files
+    QSettings.setPath(QSettings.NativeFormat, QSettings.UserScope, work_dir)
+    QSettings.setPath(QSettings.IniFormat, QSettings.UserScope, work_dir)
+    # and out of the user's session state, thumbnails and decode cache
+    QStandardPaths.setTestModeEnabled(True)
+
+    import main
+    from filters import BUILTIN_FILTERS
+
+    app = QApplication.instance() or QApplication([])
+    window = None
+    try:
+        image_path = os.path.join(work_dir, 'synthetic.npy')
+        height, width = make_synthetic_image(image_path, megapixels)
+        results = {'width': width, 'height': height}
+
+        window = main.ImageCropper()
+        window.resize(1600, 1000)
+        window.show()
+        app.processEvents()
+
+        window.image_path = image_path
+        window.crop_folder = work_dir
+        results['open'] = timed(window.load_image, 1)
+
+        def render():
+            # The view scales the tiles when it paints, so include painting the frame
+            window.display_image()
+            window.image_view.viewport().repaint()
+        results['display_image'] = timed(render, repeats)
+        results['update_mini_map'] = timed(window.update_mini_map, repeats)
+
+        def pan():
+            # Render every step, as if each key press got its own frame
+            window.keyPressEvent(QKeyEvent(QEvent.KeyPress, Qt.Key_Right, Qt.NoModifier))
+            render()
+        results['pan'] = timed(pan, repeats)
+
+        window.zoom_factor = 0.05
+        results['display_image_zoom_5pct'] = timed(render, repeats)
+        window.zoom_factor = 1.0
+        window.display_image()
+
+        positions = iter(np.random.default_rng(1).integers(0, min(width, height), size=(repeats, 2)))
+
+        def crop():
+            x, y = next(positions)
+            window.crop_at_position(int(x), int(y))
+        crop_timing = timed(crop, repeats)
+        start = time.perf_counter()
+        window.crop_queue.executor.shutdown(wait=True)
+        crop_timing['drain_ms'] = (time.perf_counter() - start) * 1000
+        results['crop_at_position'] = crop_timing
+
+        crop_image = window.image_source.read_region(0, 0, 256, 256)
+        results['filters'] = {}
+        for filter_class in BUILTIN_FILTERS:
+            filter = filter_class()
+            results['filters'][filter.name] = timed(lambda: filter.apply(crop_image), repeats)
+
+        results['peak_rss_mb'] = peak_rss_mb()
+    finally:
+        # Remove the synthetic image (gigabytes for the large sizes), crops and manifest
+        if window is not None:
+            if window.image_source is not None:
+                window.image_source.close()
+            window.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def run_all(sizes, repeats):
+    """Benchmark every size in a separate process."""
+    results = {}
+    for megapixels in sizes:
+        print(f"Benchmarking {megapixels:g} MP...", file=sys.stderr)
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', f"{megapixels:g}", '--repeats', str(repeats)],
+            check=True, stdout=subprocess.PIPE, cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout
+        results[f"{megapixels:g}"] = json.loads(output)
+    return results
+
+
+def git_commit():
+    """Current commit of the repository, if available."""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], check=True, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results, prefix=''):
+    """Flatten nested results into {'size/metric/...': value} for comparison."""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}/{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and (key.endswith('_ms') or key.endswith('_mb')):
+            flat[name] = value
+    return flat
+
+
+def compare(baseline_path, current_path, threshold):
+    """Print the ratio of every metric and return the number of regressions."""
+    with open(baseline_path) as f:
+        baseline = flatten(json.load(f)['results'])
+    with open(current_path) as f:
+        current = flatten(json.load(f)['results'])
+
+    regressions = 0
+    for name in sorted(set(baseline) & set(current)):
+        if name.endswith('/min_ms') or name.endswith('/max_ms'):
+            continue
+        before, after = baseline[name], current[name]
+        ratio = after / before if before else float('inf')
+        flag = ''
+        if ratio > threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print(f"{name:60s} {before:10.2f} -> {after:10.2f}  x{ratio:5.2f}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ImageCropper hot paths.")
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1, 16, 100],
+                        help="Synthetic image sizes in megapixels (default: 1 16 100)")
+    parser.add_argument('--repeats', type=int, default=10, help="Repeats per timing (default: 10)")
+    parser.add_argument('--output', default='benchmark.json', help="Where to save the results")
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help="Compare two result files instead of running")
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help="Slowdown ratio reported as a regression (default: 1.2)")
+    parser.add_argument('--child', type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child is not None:
+        json.dump(run_size(args.child, args.repeats), sys.stdout)
+        return 0
+
+    if args.compare:
+        return 1 if compare(args.compare[0], args.compare[1], args.threshold) else 0
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': run_all(args.sizes, args.repeats),
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved results to {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+import multiprocessing
+import os
+import threading
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from filters import Filter
+from process_pool import spawn_executor
+
+# Compiled apply functions of the snippets seen by this worker process, by source code
+_compiled_snippets = {}
+
+
+def _compile_snippet(code):
+    """Run a filter snippet once per worker process and return its apply function."""
+    apply_func = _compiled_snippets.get(code)
+    if apply_func is None:
+        namespace = {'np': np, 'cv2': cv2}
+        exec(code, namespace)
+        apply_func = namespace.get('apply')
+        if not callable(apply_func):
+            raise ValueError("Code must define an 'apply' function")
+        _compiled_snippets[code] = apply_func
+    return apply_func
+
+
+def _check_snippet(code):
+    """Run the top-level code of a snippet, raising its errors (runs in a worker process)."""
+    _compile_snippet(code)
+
+
+def _to_shared_memory(array):
+    """Copy an array into a new shared memory block; returns the block and its description."""
+    block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+
+def _apply_compiled(code, image, batch):
+    """Apply a snippet to an image, or to every image of a stack if batch, in this process."""
+    apply_func = _compile_snippet(code)
+    if batch:
+        return np.stack([np.asarray(apply_func(item)) for item in image])
+    return np.asarray(apply_func(image))
+
+
+def _apply_snippet(code, image_block, shape, dtype, batch):
+    """Apply a snippet to the image in a shared memory block and share the result."""
+    image = np.ndarray(shape, dtype=np.dtype(dtype), buffer=image_block.buf)
+    result = _apply_compiled(code, image, batch)
+    # The parent reads the result from shared memory and unlinks it
+    result_block, result_info = _to_shared_memory(result)
+    result_block.close()
+    return result_info
+
+
+def _run_snippet(code, image_info, batch):
+    """Apply a snippet to an image (or a stack if batch) in shared memory (runs in a worker process)."""
+    name, shape, dtype = image_info
+    image_block = shared_memory.SharedMemory(name=name)
+    try:
+        return _apply_snippet(code, image_block, shape, dtype, batch)
+    finally:
+        try:
+            image_block.close()
+        except BufferError:
+            # A failed snippet's traceback still references the image
+            pass
+
+
+class CodeFilterPool:
+    """Pool of worker processes that run the custom code filters.
+
+    Images go to and come back from the workers through shared memory, so only the
+    names of the blocks are pickled.
+    """
+    def __init__(self, max_workers=None):
+        self.executor = spawn_executor(max_workers or os.cpu_count())
+
+    def run(self, code, image, batch=False):
+        """Apply a snippet to an image in a worker process and return the result."""
+        image_block, image_info = _to_shared_memory(np.ascontiguousarray(image))
+        try:
+            name, shape, dtype = self.executor.submit(_run_snippet, code, image_info, batch).result()
+        finally:
+            image_block.close()
+            image_block.unlink()
+
+        result_block = shared_memory.SharedMemory(name=name)
+        try:
+            return np.ndarray(shape, dtype=np.dtype(dtype), buffer=result_block.buf).copy()
+        finally:
+            result_block.close()
+            result_block.unlink()
+
+    def shutdown(self):
+        """Stop the worker processes."""
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+_pool = None
+_pool_lock = threading.Lock()  # Crop worker threads may start the pool concurrently
+
+
+def code_filter_pool():
+    """Return the shared pool of custom filter workers, starting it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = CodeFilterPool()
+        return _pool
+
+
+def shutdown_code_filter_pool():
+    """Stop the shared pool if it was started."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+class CodeFilter(Filter):
+    """Custom filter defined by a code snippet with an ``apply(image)`` function.
+
+    The snippet only runs in the worker processes of the code filter pool, so a slow
+    filter neither holds the GIL of the viewer nor blocks other filters. A filter that
+    is already applied in a worker process (a grid crop chunk) runs the snippet there,
+    rather than starting a pool of its own.
+    """
+    def __init__(self, name, code):
+        super().__init__(name, icon='icons/filter-outline.svg')
+        # Run the snippet once now, so a broken snippet fails here rather than on every crop
+        if multiprocessing.parent_process() is not None:
+            _compile_snippet(code)
+        else:
+            code_filter_pool().executor.submit(_check_snippet, code).result()
+        self.code = code
+
+    def apply(self, image):
+        if multiprocessing.parent_process() is not None:
+            return _apply_compiled(self.code, image, batch=False)
+        return code_filter_pool().run(self.code, image)
+
+    def apply_batch(self, images):
+        if multiprocessing.parent_process() is not None:
+            return _apply_compiled(self.code, images, batch=True)
+        return code_filter_pool().run(self.code, images, batch=True)
@@ -0,0 +1,138 @@
+import io
+import json
+import os
+import tarfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from jsonl import iter_records, open_for_append
+
+BLOCK_SIZE = tarfile.BLOCKSIZE
+END_OF_ARCHIVE = b'\0' * (2 * BLOCK_SIZE)
+
+
+class CropArchive:
+    """Crop sink that appends crops to a few large tar shards instead of one file per crop.
+
+    Shards are named ``crops-00000.tar``, ``crops-00001.tar``, ... and a new one is
+    started once a shard reaches ``shard_bytes``. ``index.jsonl`` records the shard,
+    data offset and size of every crop, so a crop is read with a single seek and the
+    shards stay plain tar files that standard tools can list or extract.
+
+    Crops are appended to the index only once their data is written, and reopening an
+    archive truncates its last shard to the last indexed crop, so appending is safe
+    across sessions and after a crash. Only one process may write an archive at a time.
+    """
+    def __init__(self, folder, shard_bytes=1024 ** 3):
+        self.folder = folder
+        self.shard_bytes = shard_bytes
+        self._lock = threading.Lock()  # Crops are written from the crop worker threads
+        os.makedirs(folder, exist_ok=True)
+        self.index = read_index(folder)
+
+        # Append to the end of the last indexed crop of the last shard
+        self.shard = max((entry['shard'] for entry in self.index.values()), default=0)
+        end = max((_padded(entry['offset'] + entry['size']) for entry in self.index.values()
+                   if entry['shard'] == self.shard), default=0)
+        shard_path = self._shard_path(self.shard)
+        # Not append mode: the end of archive marker is written over by the next crop
+        self._shard_file = open(shard_path, 'r+b' if os.path.exists(shard_path) else 'w+b')
+        self._shard_file.truncate(end)
+        self._shard_file.seek(end)
+        self._shard_file.write(END_OF_ARCHIVE)
+        self._shard_file.seek(end)
+        self._index_file = open_for_append(os.path.join(folder, 'index.jsonl'))
+
+    def _shard_path(self, shard):
+        return os.path.join(self.folder, f'crops-{shard:05d}.tar')
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def write(self, name, data):
+        """Append the encoded bytes of a crop; a crop with the same name is replaced."""
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        header = info.tobuf(tarfile.GNU_FORMAT)
+        with self._lock:
+            f = self._shard_file
+            if f.tell() > 0 and f.tell() + len(header) + len(data) > self.shard_bytes:
+                self._next_shard()
+                f = self._shard_file
+            offset = f.tell() + len(header)
+            f.write(header)
+            f.write(data)
+            f.write(b'\0' * (_padded(len(data)) - len(data)))
+            # Keep the shard a complete tar file, the end marker is overwritten by the next crop
+            f.write(END_OF_ARCHIVE)
+            f.flush()
+            f.seek(-len(END_OF_ARCHIVE), os.SEEK_END)
+
+            entry = {'name': name, 'shard': self.shard, 'offset': offset, 'size': len(data)}
+            self._index_file.write(json.dumps(entry) + '\n')
+            self._index_file.flush()
+            self.index[name] = entry
+        return name
+
+    def _next_shard(self):
+        """Close the current shard and start the next one."""
+        self._shard_file.close()
+        self.shard += 1
+        self._shard_file = open(self._shard_path(self.shard), 'w+b')
+
+    def read(self, name):
+        """Return the encoded bytes of a crop."""
+        return read_crop(self.folder, self.index[name])
+
+    def close(self):
+        """Close the shard and index files."""
+        with self._lock:
+            self._shard_file.close()
+            self._index_file.close()
+
+
+def _padded(size):
+    """Size rounded up to a whole number of tar blocks."""
+    return -(-size // BLOCK_SIZE) * BLOCK_SIZE
+
+
+def read_index(folder):
+    """Return {name: entry} of the crops in an archive folder; later entries replace earlier ones."""
+    # A crop whose index line was cut short by a crash is overwritten by the next one
+    return {entry['name']: entry for entry in iter_records(os.path.join(folder, 'index.jsonl'))}
+
+
+def read_crop(folder, entry):
+    """Return the encoded bytes of an index entry, with one seek into its shard."""
+    with open(os.path.join(folder, f"crops-{entry['shard']:05d}.tar"), 'rb') as f:
+        f.seek(entry['offset'])
+        return f.read(entry['size'])
+
+
+def decode_crop(name, data):
+    """Decode the bytes of a crop, in the format given by the extension of its name."""
+    if name.lower().endswith('.npy'):
+        return np.load(io.BytesIO(data))
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+
+
+def iter_crops(folder):
+    """Yield (name, image) for every crop of an archive folder, one shard at a time."""
+    entries = sorted(read_index(folder).values(), key=lambda entry: (entry['shard'], entry['offset']))
+    shard, f = None, None
+    try:
+        for entry in entries:
+            if entry['shard'] != shard:
+                if f is not None:
+                    f.close()
+                shard = entry['shard']
+                f = open(os.path.join(folder, f'crops-{shard:05d}.tar'), 'rb')
+            f.seek(entry['offset'])
+            yield entry['name'], decode_crop(entry['name'], f.read(entry['size']))
+    finally:
+        if f is not None:
+            f.close()
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+
+from decode_cache import file_key
+from jsonl import iter_records, open_for_append
+
+
+def image_key(image_path):
+    """Identity of an image file in the manifest: its contents key, or its path if it cannot be read."""
+    try:
+        return file_key(image_path)
+    except OSError:
+        return os.path.abspath(image_path)
+
+
+def chain_description(filter_chain):
+    """Names of the filters of a chain; custom code filters also get a hash of their code."""
+    description = []
+    for filter in filter_chain.filters:
+        code = getattr(filter, 'code', None)
+        if code is None:
+            description.append(filter.name)
+        else:
+            description.append(f"{filter.name}#{hashlib.sha1(code.encode('utf-8')).hexdigest()[:12]}")
+    return description
+
+
+class CropManifest:
+    """Append-only JSON-lines record (``manifest.jsonl``) of the crops written to a folder.
+
+    Every line records the crop file, source image, centre, size, filters, format and
+    a hash of the crop pixels. The keys of the recorded crops are kept in a set, so a
+    crop that was already made is recognised in O(1) before it is filtered and encoded,
+    and every crop file maps to the key of the last crop written to it.
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, 'manifest.jsonl')
+        self._keys = set()
+        self._files = {}  # Crop file -> key of its last record
+        self._lock = threading.Lock()
+        for entry in iter_records(self.path):
+            key = self._files[entry['file']] = self._entry_key(entry)
+            self._keys.add(key)
+        self._file = open_for_append(self.path)
+
+    @staticmethod
+    def key(image_key, x, y, crop_size, filters, encoder):
+        """Key of a crop: what it was cut from and how it was made."""
+        return image_key, int(x), int(y), int(crop_size), tuple(filters), str(encoder)
+
+    @classmethod
+    def _entry_key(cls, entry):
+        return cls.key(entry['image_key'], entry['x'], entry['y'], entry['size'], entry['filters'],
+                       entry['format'])
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def key_of(self, crop_file):
+        """Key of the last crop recorded for a crop file, None if it has no record."""
+        return self._files.get(crop_file)
+
+    @staticmethod
+    def entry(key, crop_file, image_path, crop):
+        """Build the record of a crop, hashing its (unfiltered) pixels.
+
+        Does not need an open manifest, so worker processes build the records of their
+        crops and the parent adds them.
+        """
+        image_key, x, y, crop_size, filters, encoder = key
+        return {
+            'file': crop_file,
+            'image': image_path,
+            'image_key': image_key,
+            'x': x,
+            'y': y,
+            'size': crop_size,
+            'filters': list(filters),
+            'format': encoder,
+            'sha1': hashlib.sha1(crop.tobytes()).hexdigest(),
+            'time': datetime.now().isoformat(timespec='seconds'),
+        }
+
+    def add(self, entry):
+        """Append the record of a written crop."""
+        self.add_all([entry])
+
+    def add_all(self, entries):
+        """Append the records of written crops, flushing once."""
+        with self._lock:
+            for entry in entries:
+                self._file.write(json.dumps(entry) + '\n')
+                key = self._files[entry['file']] = self._entry_key(entry)
+                self._keys.add(key)
+            self._file.flush()
+
+    def close(self):
+        """Close the manifest file."""
+        with self._lock:
+            self._file.close()
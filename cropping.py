@@ -0,0 +1,137 @@
+import io
+import os
+import time
+
+import cv2
+import numpy as np
+
+from timing import timers
+
+
+def crop_bounds(x, y, crop_size, image_size):
+    """Return (x_start, y_start, x_end, y_end) of a crop centred on (x, y), clipped to the image.
+
+    image_size is (height, width).
+    """
+    crop_half_size = crop_size // 2
+    x_start = max(0, int(x - crop_half_size))
+    y_start = max(0, int(y - crop_half_size))
+    x_end = min(image_size[1], int(x + crop_half_size))
+    y_end = min(image_size[0], int(y + crop_half_size))
+    return x_start, y_start, x_end, y_end
+
+
+def crop_file_name(image_path, x, y, extension='.png'):
+    """Name of the file a crop centred on (x, y) of image_path is saved as."""
+    name, ext = os.path.splitext(os.path.basename(image_path))
+    return f"{name}_crop_{x}_{y}{extension}"
+
+
+# Output formats of the crops:
+# name -> (extension, OpenCV parameter set by the level, default level, (min level, max level))
+CROP_FORMATS = {
+    'PNG': ('.png', cv2.IMWRITE_PNG_COMPRESSION, 1, (0, 9)),  # Compression, 0 is fastest
+    'JPEG': ('.jpg', cv2.IMWRITE_JPEG_QUALITY, 95, (0, 100)),
+    'WebP': ('.webp', cv2.IMWRITE_WEBP_QUALITY, 90, (1, 101)),  # Quality, above 100 is lossless
+    'TIFF': ('.tif', None, None, None),  # Uncompressed
+    'NumPy': ('.npy', None, None, None),  # Raw array, no encoding at all
+}
+
+
+class CropEncoder:
+    """Output format of the crops, with its compression level or quality."""
+    def __init__(self, format='PNG', level=None):
+        if format not in CROP_FORMATS:
+            raise ValueError(f"Unknown crop format: {format}")
+        self.format = format
+        self.extension, self.parameter, default_level, level_range = CROP_FORMATS[format]
+        self.level = default_level if level is None or level_range is None else int(level)
+        if level_range is not None and not level_range[0] <= self.level <= level_range[1]:
+            raise ValueError(f"{format} level must be between {level_range[0]} and {level_range[1]}")
+
+    def __repr__(self):
+        if self.level is None:
+            return self.format
+        return f"{self.format} {self.level}"
+
+    def encode(self, crop):
+        """Return the encoded bytes of a crop."""
+        if self.format == 'NumPy':
+            buffer = io.BytesIO()
+            np.save(buffer, crop)
+            return buffer.getvalue()
+        if self.format == 'TIFF':
+            params = [cv2.IMWRITE_TIFF_COMPRESSION, 1]
+        else:
+            params = [self.parameter, self.level]
+        ok, encoded = cv2.imencode(self.extension, crop, params)
+        if not ok:
+            raise IOError(f"Unable to encode the crop as {self}")
+        return encoded.tobytes()
+
+
+def measure_encoder(encoder, crops):
+    """Encode sample crops; returns (mean milliseconds, mean bytes) per crop."""
+    total_bytes = 0
+    start = time.perf_counter()
+    for crop in crops:
+        total_bytes += len(encoder.encode(crop))
+    elapsed = time.perf_counter() - start
+    return elapsed * 1000 / len(crops), total_bytes / len(crops)
+
+
+def compare_encoders(crops, encoders=None):
+    """Measure encoders on sample crops; returns a list of (encoder, mean ms, mean bytes).
+
+    By default every format is measured at a few levels, from fastest to smallest.
+    """
+    if encoders is None:
+        encoders = [CropEncoder('PNG', level) for level in (0, 1, 3, 6, 9)]
+        encoders += [CropEncoder('JPEG', level) for level in (75, 90, 95)]
+        encoders += [CropEncoder('WebP', level) for level in (75, 90, 101)]
+        encoders += [CropEncoder('TIFF'), CropEncoder('NumPy')]
+    return [(encoder, *measure_encoder(encoder, crops)) for encoder in encoders]
+
+
+def save_crop(crop, crop_path, encoder=None, sink=None):
+    """Encode an already filtered crop (as PNG by default) and write it to disk.
+
+    With a sink (such as a CropArchive) the crop is written to the sink, under the file
+    name of crop_path, instead of to its own file.
+    """
+    encoder = encoder or CropEncoder()
+    with timers.stage('encode'):
+        encoded = encoder.encode(crop)
+    with timers.stage('write'):
+        if sink is not None:
+            sink.write(os.path.basename(crop_path), encoded)
+        else:
+            with open(crop_path, 'wb') as f:
+                f.write(encoded)
+    return crop_path
+
+
+def write_crop(crop, filter_chain, crop_path, encoder=None, sink=None):
+    """Apply the filter chain to a crop and write it to disk."""
+    with timers.stage('filters'):
+        crop = filter_chain.apply(crop)
+    return save_crop(crop, crop_path, encoder, sink)
+
+
+def write_crop_batch(crops, filter_chain, crop_paths, encoder=None, sink=None):
+    """Filter a list of crops together and write them to disk.
+
+    Crops of the full size are stacked and filtered with one apply_batch call, the
+    smaller ones clipped at the image border are filtered one by one.
+    """
+    full_size = max(crop.shape for crop in crops)
+    stacked = [i for i, crop in enumerate(crops) if crop.shape == full_size]
+    if stacked:
+        with timers.stage('filters'):
+            filtered = filter_chain.apply_batch(np.stack([crops[i] for i in stacked]))
+        for i, crop in zip(stacked, filtered):
+            save_crop(crop, crop_paths[i], encoder, sink)
+    for i, crop in enumerate(crops):
+        if crop.shape != full_size:
+            write_crop(crop, filter_chain, crop_paths[i], encoder, sink)
+    return len(crops)
@@ -0,0 +1,98 @@
+import hashlib
+import os
+import shutil
+import threading
+from collections import Counter
+
+# Entry folders used by open image sources of this process, with their number of users
+_open_entries = Counter()
+_open_entries_lock = threading.Lock()  # Sources are opened by the GUI and the load threads
+
+
+def file_key(path):
+    """Key identifying the current contents of a file, from its path, size and modification time."""
+    stat = os.stat(path)
+    identity = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+
+class DecodeCache:
+    """Persistent cache of decoded images as memory-mapped .npy files.
+
+    Every image gets a folder with one ``level{n}.npy`` file per pyramid level, so
+    reopening an image maps its pixels instead of decoding it again, and the OS page
+    cache shares them between sessions. Entries are keyed by the absolute path, size
+    and modification time of the image, so an edited file is decoded again.
+
+    The least recently used entries are removed once the cache grows past ``max_bytes``,
+    except the entries in use: entry_dir() marks an entry as used until release().
+    """
+    def __init__(self, root, max_bytes=10 * 1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def contains(self, path):
+        """Whether the full resolution pixels of an image are cached."""
+        try:
+            name = file_key(path)
+        except OSError:
+            return False
+        return os.path.exists(os.path.join(self.root, name, 'level0.npy'))
+
+    def entry_dir(self, path):
+        """Return the cache folder of an image, creating it if needed; it is kept until release()."""
+        entry_dir = os.path.join(self.root, file_key(path))
+        with _open_entries_lock:
+            _open_entries[entry_dir] += 1
+        if os.path.isdir(entry_dir):
+            # The folder time orders the entries for eviction
+            os.utime(entry_dir)
+        else:
+            os.makedirs(entry_dir, exist_ok=True)
+            self.prune()
+        return entry_dir
+
+    @staticmethod
+    def release(entry_dir):
+        """Allow an entry folder returned by entry_dir() to be pruned again."""
+        with _open_entries_lock:
+            _open_entries[entry_dir] -= 1
+            if _open_entries[entry_dir] <= 0:
+                del _open_entries[entry_dir]
+
+    def prune(self):
+        """Remove the least recently used entries until the cache fits in max_bytes.
+
+        Entries of open image sources are counted but never removed.
+        """
+        with _open_entries_lock:
+            in_use = set(_open_entries)
+        entries = []
+        total = 0
+        for entry in os.scandir(self.root):
+            if not entry.is_dir():
+                continue
+            size = 0
+            for file in os.scandir(entry.path):
+                try:
+                    size += file.stat().st_size
+                except OSError:
+                    pass
+            entries.append((entry.stat().st_mtime, size, entry.path))
+            total += size
+
+        for _, size, entry_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if entry_path in in_use:
+                continue
+            # Mapped files stay readable on POSIX; on Windows the folder is kept until unmapped
+            shutil.rmtree(entry_path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """Remove every entry."""
+        for entry in os.scandir(self.root):
+            if entry.is_dir():
+                shutil.rmtree(entry.path, ignore_errors=True)
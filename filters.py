@@ -0,0 +1,386 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+# Marks an output type that is the same as the filter input
+SAME = 'same'
+
+UINT8 = np.dtype(np.uint8)
+INT16 = np.dtype(np.int16)
+FLOAT32 = np.dtype(np.float32)
+
+
+class Filter:
+    """Base class for filters.
+
+    Subclasses can declare the image type they expect and produce, which lets
+    FilterChain skip redundant conversions. Undeclared types are treated as unknown.
+    """
+    input_channels = None  # 1 or 3 if the filter needs that many channels, None for any
+    input_dtypes = None  # Tuple of accepted dtypes, None for any
+    output_channels = None  # 1, 3, SAME or None if unknown
+    output_dtype = None  # A dtype, SAME or None if unknown
+
+    def __init__(self, name, icon=None):
+        self.name = name
+        self.icon = icon  # Icon associated with the filter
+
+    def result_dtype(self, dtype):
+        """Dtype of the output for input of the given dtype, or None if unknown."""
+        return dtype if self.output_dtype == SAME else self.output_dtype
+
+    def apply(self, image):
+        """Apply the filter to the image. Override in subclasses."""
+        return image
+
+    def apply_batch(self, images):
+        """Apply the filter to an N x H x W (x C) stack of images.
+
+        The default calls apply on each image in turn; override for a faster path.
+        """
+        return np.stack([self.apply(image) for image in images])
+
+
+_batch_executor = None
+
+
+def _batch_pool():
+    """Thread pool shared by the batched OpenCV filters (OpenCV releases the GIL)."""
+    global _batch_executor
+    if _batch_executor is None:
+        _batch_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix='filter')
+    return _batch_executor
+
+
+def _apply_per_pixel(function, images):
+    """Run a per-pixel OpenCV function on a whole stack with a single call.
+
+    The N x H x W (x C) stack is viewed as one (N*H) x W (x C) image, which gives the
+    same result for operations that do not look at neighbouring pixels.
+    """
+    images = np.ascontiguousarray(images)
+    result = function(images.reshape((-1,) + images.shape[2:]))
+    return result.reshape(images.shape[:3] + result.shape[2:])
+
+
+class OpenCVFilter(Filter):
+    """Filter implemented with OpenCV calls, batched over a thread pool."""
+    def apply_batch(self, images):
+        return np.stack(list(_batch_pool().map(self.apply, images)))
+
+
+# Predefined filters using OpenCV functions
+
+class GrayscaleFilter(OpenCVFilter):
+    """Convert image to grayscale."""
+    def __init__(self):
+        super().__init__('Grayscale', icon='icons/contrast-circle.svg')
+
+    input_channels = 3
+    input_dtypes = (UINT8, FLOAT32)
+    output_channels = 1
+    output_dtype = SAME
+
+    def apply(self, image):
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    def apply_batch(self, images):
+        return _apply_per_pixel(self.apply, images)
+
+
+class BlurFilter(OpenCVFilter):
+    """Apply Gaussian blur to the image."""
+    def __init__(self):
+        super().__init__('Gaussian Blur', icon='icons/blur.svg')
+
+    output_channels = SAME
+    output_dtype = SAME
+
+    def apply(self, image):
+        return cv2.GaussianBlur(image, (5, 5), 0)
+
+
+class CannyEdgeFilter(OpenCVFilter):
+    """Apply Canny edge detection."""
+    def __init__(self):
+        super().__init__('Canny Edge Detection', icon='icons/image-filter-hdr.svg')
+
+    input_channels = 1
+    input_dtypes = (UINT8,)
+    output_channels = 1
+    output_dtype = UINT8
+
+    def apply(self, image):
+        if len(image.shape) == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return cv2.Canny(image, 100, 200)
+
+
+class ThresholdFilter(OpenCVFilter):
+    """Apply binary thresholding."""
+    def __init__(self):
+        super().__init__('Threshold', icon='icons/image-filter-center-focus.svg')
+
+    input_channels = 1
+    input_dtypes = (UINT8, INT16, FLOAT32)
+    output_channels = 1
+    output_dtype = SAME
+
+    def apply(self, image):
+        if len(image.shape) == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        _, thresh = cv2.threshold(image, 127, 255, cv2.THRESH_BINARY)
+        return thresh
+
+    def apply_batch(self, images):
+        return _apply_per_pixel(self.apply, images)
+
+
+class LaplacianFilter(OpenCVFilter):
+    """Apply Laplacian operator."""
+    def __init__(self):
+        super().__init__('Laplacian', icon='icons/image-filter-drama.svg')
+
+    input_dtypes = (UINT8, INT16, FLOAT32)
+    output_channels = SAME
+    output_dtype = None  # Depends on the input, see result_dtype
+
+    def result_dtype(self, dtype):
+        return INT16 if dtype == UINT8 else FLOAT32
+
+    def apply(self, image):
+        if image.dtype == np.uint8:
+            # 16 bits are enough for the 3x3 Laplacian of 8-bit input
+            return cv2.Laplacian(image, cv2.CV_16S)
+        # Keep the range of wider input (e.g. Sobel magnitudes above 255)
+        return cv2.Laplacian(image, cv2.CV_32F)
+
+
+class SobelFilter(OpenCVFilter):
+    """Apply Sobel operator."""
+    def __init__(self):
+        super().__init__('Sobel', icon='icons/image-filter-tilt-shift.svg')
+
+    input_dtypes = (UINT8, INT16, FLOAT32)
+    output_channels = SAME
+    output_dtype = FLOAT32
+
+    def apply(self, image):
+        grad_x = cv2.Sobel(image, cv2.CV_32F, 1, 0)
+        grad_y = cv2.Sobel(image, cv2.CV_32F, 0, 1)
+        return cv2.magnitude(grad_x, grad_y)
+
+
+class ErosionFilter(OpenCVFilter):
+    """Apply morphological erosion."""
+    def __init__(self):
+        super().__init__('Erosion', icon='icons/image-filter-hdr.svg')
+
+    output_channels = SAME
+    output_dtype = SAME
+
+    def apply(self, image):
+        kernel = np.ones((5, 5), np.uint8)
+        return cv2.erode(image, kernel, iterations=1)
+
+
+class DilationFilter(OpenCVFilter):
+    """Apply morphological dilation."""
+    def __init__(self):
+        super().__init__('Dilation', icon='icons/image-filter-hdr.svg')
+
+    output_channels = SAME
+    output_dtype = SAME
+
+    def apply(self, image):
+        kernel = np.ones((5, 5), np.uint8)
+        return cv2.dilate(image, kernel, iterations=1)
+
+
+class EnsureGrayscale(OpenCVFilter):
+    """Convert to grayscale unless the image already has a single channel."""
+    def __init__(self):
+        super().__init__('Ensure Grayscale')
+
+    input_dtypes = GrayscaleFilter.input_dtypes
+    output_channels = 1
+    output_dtype = SAME
+
+    def apply(self, image):
+        if len(image.shape) == 3:
+            return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return image
+
+    def apply_batch(self, images):
+        if images.ndim == 4:
+            return _apply_per_pixel(self.apply, images)
+        return images
+
+
+class EnsureUint8(OpenCVFilter):
+    """Convert to 8 bits (absolute value, saturated) unless the image already is."""
+    def __init__(self):
+        super().__init__('Ensure 8 bits')
+
+    output_channels = SAME
+    output_dtype = UINT8
+
+    def apply(self, image):
+        if image.dtype != np.uint8:
+            return cv2.convertScaleAbs(image)
+        return image
+
+    def apply_batch(self, images):
+        return _apply_per_pixel(self.apply, images)
+
+
+def plan_filter_chain(filters, input_channels=3, input_dtype=UINT8):
+    """Return the steps needed to run the filters on images of the given type.
+
+    The image type is tracked through the chain: grayscale conversions are only kept
+    where the image still has colour, filters that need 8-bit input get one
+    conversion in front of them, and a single conversion to 8 bits is added at the
+    end if the output may not be writable as a regular image.
+    """
+    steps = []
+    channels, dtype = input_channels, input_dtype
+
+    def convert_dtype(accepted_dtypes):
+        nonlocal dtype
+        if accepted_dtypes is not None and dtype not in accepted_dtypes:
+            steps.append(EnsureUint8())
+            dtype = UINT8
+
+    def convert_to_grayscale(conversion):
+        nonlocal channels
+        if channels != 1:
+            convert_dtype(conversion.input_dtypes)
+            steps.append(conversion)
+            channels = 1
+
+    for filter in filters:
+        if isinstance(filter, GrayscaleFilter):
+            # The only job of the filter is the conversion, skip it if already done
+            convert_to_grayscale(filter if channels == 3 else EnsureGrayscale())
+            continue
+
+        if filter.input_channels == 1:
+            convert_to_grayscale(EnsureGrayscale())
+        convert_dtype(filter.input_dtypes)
+
+        steps.append(filter)
+        if filter.output_channels != SAME:
+            channels = filter.output_channels
+        dtype = filter.result_dtype(dtype)
+
+    if dtype != UINT8:
+        steps.append(EnsureUint8())
+    return steps
+
+
+class FilterChain:
+    """Filters to apply in order, compiled into the steps that actually need to run."""
+    def __init__(self, filters, input_channels=3, input_dtype=UINT8):
+        self.filters = list(filters)
+        self.steps = plan_filter_chain(self.filters, input_channels, input_dtype)
+
+    def __len__(self):
+        return len(self.filters)
+
+    def apply(self, image):
+        """Run the compiled chain on an image."""
+        for step in self.steps:
+            image = step.apply(image)
+        return image
+
+    def apply_batch(self, images):
+        """Run the compiled chain on an N x H x W (x C) stack of images."""
+        for step in self.steps:
+            images = step.apply_batch(images)
+        return images
+
+    def apply_cached(self, image, image_key, cache):
+        """Run the chain on an image, reusing the stored outputs of chain prefixes.
+
+        Outputs are stored in cache (a StageCache) under image_key and the steps that
+        produced them, so after appending or reordering filters only the steps after
+        the first change run again.
+        """
+        prefix = (image_key,)
+        start = 0
+        # Find the longest prefix of the steps already computed for this image
+        for i, step in enumerate(self.steps):
+            key = prefix + (_step_key(step),)
+            cached = cache.get(key)
+            if cached is None:
+                break
+            prefix, image, start = key, cached, i + 1
+
+        for step in self.steps[start:]:
+            image = step.apply(image)
+            prefix = prefix + (_step_key(step),)
+            cache.put(prefix, image)
+        return image
+
+
+def _step_key(step):
+    """Identify a chain step in StageCache keys."""
+    # Inserted conversions are stateless, the same class gives the same output
+    if isinstance(step, (EnsureGrayscale, EnsureUint8)):
+        return type(step)
+    return step
+
+
+class StageCache:
+    """LRU of filter chain stage outputs, keyed by image and chain prefix."""
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._outputs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the stored output for key, or None."""
+        with self._lock:
+            output = self._outputs.get(key)
+            if output is not None:
+                self._outputs.move_to_end(key)
+            return output
+
+    def put(self, key, output):
+        """Store an output, evicting the least recently used ones."""
+        with self._lock:
+            self._outputs[key] = output
+            self._outputs.move_to_end(key)
+            while len(self._outputs) > self.max_entries:
+                self._outputs.popitem(last=False)
+
+    def clear(self):
+        """Drop every stored output."""
+        with self._lock:
+            self._outputs.clear()
+
+
+# Built-in filters, in the order they are offered in the filter dialog
+BUILTIN_FILTERS = [
+    GrayscaleFilter,
+    BlurFilter,
+    CannyEdgeFilter,
+    ThresholdFilter,
+    LaplacianFilter,
+    SobelFilter,
+    ErosionFilter,
+    DilationFilter,
+]
+
+
+def filter_by_name(name):
+    """Create the built-in filter with the given display name (case-insensitive)."""
+    for filter_class in BUILTIN_FILTERS:
+        filter = filter_class()
+        if filter.name.lower() == name.lower():
+            return filter
+    raise ValueError(f"Unknown filter: {name}")
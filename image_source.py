@@ -0,0 +1,322 @@
+import os
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+
+# Folder of the spill files, None for the system temporary folder (see set_spill_dir)
+_spill_dir = None
+
+
+def set_spill_dir(folder):
+    """Create the spill files of the decoded images and pyramid levels in folder.
+
+    The system temporary folder is RAM on systems where it is a tmpfs, which would
+    keep the whole decoded image in memory; a folder on disk keeps it out of RAM.
+    """
+    global _spill_dir
+    os.makedirs(folder, exist_ok=True)
+    _spill_dir = folder
+
+
+def _remove_file(path):
+    """Remove a file, ignoring errors (used to clean up spill files)."""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+# Reduced-size decodes; JPEG decoders scale while decoding, which skips most of the work
+_REDUCED_READ_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+_JPEG_EXTENSIONS = ('.jpg', '.jpeg', '.jpe', '.jfif')
+
+
+def supports_reduced_decode(path):
+    """Whether a reduced-size decode of the image is faster than a full one.
+
+    Only JPEG decoders scale while decoding; other formats are decoded in full and
+    resized, which costs as much as the full decode.
+    """
+    return path.lower().endswith(_JPEG_EXTENSIONS)
+
+
+class ImageSource:
+    """Read-only, tiled access to a large image.
+
+    The decoded pixels are kept in a memory-mapped file on disk and read back in
+    tiles of ``tile_size`` pixels, so only the parts of the image that are actually
+    looked at become resident in memory. Recently used tiles are kept in a small LRU.
+
+    Level 0 is the full resolution image; level n is downsampled by 2**n and is built
+    lazily the first time it is read, so zoomed-out views read few pixels.
+
+    With a ``reduction`` of 2, 4 or 8 only a reduced-size decode is made, which is much
+    faster for large JPEGs (see supports_reduced_decode). Such a preview stands in for
+    the full image: its shape is the decoded size times the reduction, which is the full
+    size rounded up to the reduction for JPEG and rounded down for other formats, and
+    levels finer than the decoded one cannot be read, see ``base_level``. Images too
+    small for the reduction are decoded in full instead.
+
+    With a ``cache`` (a DecodeCache) the decoded pixels and pyramid levels are kept in
+    the cache instead of temporary files, and reused by the next source of the image.
+    """
+    def __init__(self, path, tile_size=512, max_cached_tiles=64, reduction=1, cache=None):
+        if reduction not in _REDUCED_READ_FLAGS:
+            raise ValueError(f"Unsupported reduction: {reduction}")
+        self.path = path
+        self.tile_size = tile_size
+        self.max_cached_tiles = max_cached_tiles
+        self._tiles = OrderedDict()  # (level, tile_x, tile_y) -> decoded tile
+        self._lock = threading.Lock()  # Tiles are read from the GUI and from crop workers
+        self._levels_lock = threading.RLock()  # Guards lazy pyramid construction
+        self.pixels_path = None  # .npy file holding the full resolution pixels, None for a preview
+        if reduction > 1:
+            try:
+                self._pixels = self._open_reduced_pixels(path, reduction)
+            except cv2.error:
+                # Some decoders reject images smaller than the reduction
+                reduction = 1
+        self.base_level = reduction.bit_length() - 1  # Finest level that can be read
+        # Folder of the cached levels; raw arrays and previews are not cached
+        self._cache_dir = None
+        if cache is not None and reduction == 1 and not path.lower().endswith('.npy'):
+            self._cache_dir = cache.entry_dir(path)
+            # Keep the entry from being pruned while this source may still build levels in it
+            self._release_cache_entry = weakref.finalize(self, cache.release, self._cache_dir)
+        if reduction == 1:
+            self.pixels_path = path
+            self._pixels = self._open_pixels(path)
+        self.height, self.width = (size * reduction for size in self._pixels.shape[:2])
+
+        # Stop the pyramid once a level fits in a single tile
+        level_count = 1
+        height, width = self.height, self.width
+        while max(height, width) > tile_size:
+            height, width = (height + 1) // 2, (width + 1) // 2
+            level_count += 1
+        level_count = max(level_count, self.base_level + 1)
+        self._levels = [None] * level_count
+        self._levels[self.base_level] = self._pixels
+
+    @property
+    def shape(self):
+        """Size of the image as (height, width)."""
+        return self.height, self.width
+
+    @property
+    def level_count(self):
+        """Number of pyramid levels, including the full resolution level."""
+        return len(self._levels)
+
+    @property
+    def is_preview(self):
+        """Whether only a reduced-resolution decode of the image is available."""
+        return self.base_level > 0
+
+    def level_shape(self, level):
+        """Size of a pyramid level as (height, width)."""
+        height, width = self.height, self.width
+        for _ in range(level):
+            height, width = (height + 1) // 2, (width + 1) // 2
+        return height, width
+
+    def level_for_zoom(self, zoom):
+        """Return the coarsest pyramid level that still has at least ``zoom`` pixels per image pixel."""
+        level = self.base_level
+        while level < self.level_count - 1 and zoom <= 0.5 ** (level + 1):
+            level += 1
+        return level
+
+    def _create_spill(self, shape):
+        """Create a temporary writable memory-mapped array, removed with this source."""
+        fd, spill_path = tempfile.mkstemp(prefix='imagecropper_', suffix='.npy', dir=_spill_dir)
+        os.close(fd)
+        weakref.finalize(self, _remove_file, spill_path)
+        return spill_path, np.lib.format.open_memmap(spill_path, mode='w+', dtype=np.uint8, shape=shape)
+
+    def _cached_level_path(self, level):
+        """Path of a level in the decode cache, or None without a cache."""
+        if self._cache_dir is None:
+            return None
+        return os.path.join(self._cache_dir, f'level{level}.npy')
+
+    def _write_level(self, level, shape, fill):
+        """Create a level file, fill it with fill(array) and return its path, mapped read-only.
+
+        Cached levels are written under a temporary name and renamed when complete, so
+        an interrupted write never leaves a partial entry; other levels go to a spill file.
+        """
+        cached_path = self._cached_level_path(level)
+        if cached_path is None:
+            level_path, array = self._create_spill(shape)
+        else:
+            try:
+                fd, level_path = tempfile.mkstemp(dir=self._cache_dir, suffix='.tmp')
+            except FileNotFoundError:
+                # The entry was removed from the cache (e.g. cleared); keep the level in a spill file
+                cached_path = None
+                level_path, array = self._create_spill(shape)
+            else:
+                os.close(fd)
+                array = np.lib.format.open_memmap(level_path, mode='w+', dtype=np.uint8, shape=shape)
+        try:
+            fill(array)
+            array.flush()
+            del array
+            if cached_path is not None:
+                os.replace(level_path, cached_path)
+                level_path = cached_path
+        except BaseException:
+            if cached_path is not None:
+                _remove_file(level_path)
+            raise
+        return level_path, np.load(level_path, mmap_mode='r')
+
+    def _open_pixels(self, path):
+        """Return a memory-mapped (height, width, 3) uint8 array with the image pixels."""
+        if path.lower().endswith('.npy'):
+            # Raw arrays can be mapped directly, nothing needs to be decoded
+            pixels = np.load(path, mmap_mode='r')
+            if pixels.ndim == 3 and pixels.shape[2] == 3 and pixels.dtype == np.uint8:
+                return pixels
+            raise ValueError(f"Unsupported array layout in {path}: {pixels.shape} {pixels.dtype}")
+
+        cached_path = self._cached_level_path(0)
+        if cached_path is not None and os.path.exists(cached_path):
+            self.pixels_path = cached_path
+            return np.load(cached_path, mmap_mode='r')
+
+        # OpenCV cannot decode a sub-region of a compressed file, so decode it once
+        # and spill the pixels to a file that is mapped back read-only.
+        decoded = cv2.imread(path, cv2.IMREAD_COLOR)
+        if decoded is None:
+            raise ValueError(f"Unable to open the image: {path}")
+
+        def fill(array):
+            array[:] = decoded
+        self.pixels_path, pixels = self._write_level(0, decoded.shape, fill)
+        return pixels
+
+    def _open_reduced_pixels(self, path, reduction):
+        """Decode the image at 1/reduction of its size; small enough to keep in memory."""
+        decoded = cv2.imread(path, _REDUCED_READ_FLAGS[reduction])
+        if decoded is None:
+            raise ValueError(f"Unable to open the image: {path}")
+        return decoded
+
+    def _level_pixels(self, level):
+        """Return the pixels of a pyramid level, building it (and the levels above) if needed."""
+        pixels = self._levels[level]
+        if pixels is not None:
+            return pixels
+        if level < self.base_level:
+            raise ValueError(f"Level {level} is finer than the decoded preview of {self.path}")
+        with self._levels_lock:
+            if self._levels[level] is None:
+                cached_path = self._cached_level_path(level)
+                if cached_path is not None and os.path.exists(cached_path):
+                    self._levels[level] = np.load(cached_path, mmap_mode='r')
+                    return self._levels[level]
+
+                parent = self._level_pixels(level - 1)
+                height, width = self.level_shape(level)
+
+                def fill(array):
+                    # Halve the parent level in strips so it never has to be resident at once
+                    rows = self.tile_size
+                    for row_start in range(0, height, rows):
+                        row_end = min(height, row_start + rows)
+                        strip = parent[row_start * 2:row_end * 2]
+                        array[row_start:row_end] = cv2.resize(strip, (width, row_end - row_start),
+                                                              interpolation=cv2.INTER_AREA)
+                self._levels[level] = self._write_level(level, (height, width, 3), fill)[1]
+        return self._levels[level]
+
+    def tile(self, tile_x, tile_y, level=0):
+        """Return the tile at the given tile coordinates of a level, decoding it if needed."""
+        key = (level, tile_x, tile_y)
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+                return tile
+
+        x_start = tile_x * self.tile_size
+        y_start = tile_y * self.tile_size
+        pixels = self._level_pixels(level)
+        tile = np.ascontiguousarray(pixels[y_start:y_start + self.tile_size,
+                                           x_start:x_start + self.tile_size])
+
+        with self._lock:
+            self._tiles[key] = tile
+            while len(self._tiles) > self.max_cached_tiles:
+                self._tiles.popitem(last=False)
+        return tile
+
+    def read_region(self, x, y, width, height, level=0):
+        """Read a (height, width, 3) window of a level, clipped to the level bounds.
+
+        Coordinates are in pixels of the requested level.
+        """
+        level_height, level_width = self.level_shape(level)
+        x_start = max(0, int(x))
+        y_start = max(0, int(y))
+        x_end = min(level_width, int(x) + int(width))
+        y_end = min(level_height, int(y) + int(height))
+        if x_end <= x_start or y_end <= y_start:
+            return np.empty((0, 0, 3), dtype=np.uint8)
+
+        region = np.empty((y_end - y_start, x_end - x_start, 3), dtype=np.uint8)
+        size = self.tile_size
+        for tile_y in range(y_start // size, (y_end - 1) // size + 1):
+            for tile_x in range(x_start // size, (x_end - 1) // size + 1):
+                tile = self.tile(tile_x, tile_y, level)
+                # Intersection of the tile with the requested window, in level coordinates
+                ix0 = max(x_start, tile_x * size)
+                iy0 = max(y_start, tile_y * size)
+                ix1 = min(x_end, tile_x * size + tile.shape[1])
+                iy1 = min(y_end, tile_y * size + tile.shape[0])
+                region[iy0 - y_start:iy1 - y_start, ix0 - x_start:ix1 - x_start] = \
+                    tile[iy0 - tile_y * size:iy1 - tile_y * size, ix0 - tile_x * size:ix1 - tile_x * size]
+        return region
+
+    def thumbnail(self, max_size):
+        """Downsample the whole image to fit in max_size x max_size, keeping the aspect ratio.
+
+        The image is streamed in horizontal strips with area interpolation, so the full
+        image never has to be resident at once.
+        """
+        pixels = self._pixels
+        pixels_height, pixels_width = pixels.shape[:2]
+        scale = min(max_size / pixels_width, max_size / pixels_height)
+        width = max(1, round(pixels_width * scale))
+        height = max(1, round(pixels_height * scale))
+        thumb = np.empty((height, width, 3), dtype=np.uint8)
+        for y_start in range(0, pixels_height, self.tile_size):
+            y_end = min(pixels_height, y_start + self.tile_size)
+            row_start = y_start * height // pixels_height
+            row_end = y_end * height // pixels_height
+            if row_end > row_start:
+                strip = pixels[y_start:y_end]
+                thumb[row_start:row_end] = cv2.resize(strip, (width, row_end - row_start),
+                                                      interpolation=cv2.INTER_AREA)
+        return thumb
+
+    def close(self):
+        """Release the cached tiles and the mapped pixels."""
+        with self._lock:
+            self._tiles.clear()
+        self._pixels = None
+        self._levels = [None] * len(self._levels)
+        if self._cache_dir is not None:
+            self._release_cache_entry()
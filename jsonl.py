@@ -0,0 +1,33 @@
+import json
+import os
+
+
+def iter_records(path):
+    """Yield the records of a JSON-lines file; a missing file has none.
+
+    Lines that do not parse, such as a last line cut short by a crash, are skipped.
+    """
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+    except FileNotFoundError:
+        pass
+
+
+def open_for_append(path):
+    """Open a JSON-lines file for appending records, one per line.
+
+    If the file ends with a line cut short by a crash, the line is terminated so the
+    next record starts on its own line.
+    """
+    f = open(path, 'a')
+    if f.tell() > 0:
+        with open(path, 'rb') as existing:
+            existing.seek(-1, os.SEEK_END)
+            if existing.read(1) != b'\n':
+                f.write('\n')
+    return f
@@ -1,211 +1,379 @@
 import sys
 import os
-import cv2
 import subprocess
 import numpy as np
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QLabel, QFileDialog, QVBoxLayout, QHBoxLayout, QWidget,
     QPushButton, QGraphicsView, QGraphicsScene, QMessageBox, QInputDialog, QToolBar, QAction,
     QDialog, QListWidget, QListWidgetItem, QSizePolicy, QToolBox, QTextEdit, QLineEdit,
-    QAbstractItemView, QScrollArea
+    QAbstractItemView, QScrollArea, QFrame, QComboBox, QSpinBox, QFormLayout, QCheckBox, QProgressDialog
+)
+from PyQt5.QtCore import (
+    Qt, QRect, QRectF, pyqtSignal, QSettings, QSize, QPoint, QObject, QTimer, QElapsedTimer, QStandardPaths
+)
+from PyQt5.QtGui import (
+    QImage, QPixmap, QPen, QColor, QIcon, QSyntaxHighlighter, QTextCharFormat, QFont, QTransform
 )
-from PyQt5.QtCore import Qt, QRectF, pyqtSignal, QSettings, QSize, QPoint
-from PyQt5.QtGui import QImage, QPixmap, QPen, QColor, QPainter, QIcon, QSyntaxHighlighter, QTextCharFormat, QFont
 from PyQt5.QtCore import QRegExp
 
-
-class ImageLabel(QLabel):
-    """Custom QLabel to handle mouse events and drawing."""
-    mouse_clicked = pyqtSignal(int, int)
+from batch_crop import chunked, crop_chunk, grid_axes, grid_positions
+from code_filters import CodeFilter, shutdown_code_filter_pool
+from crop_archive import CropArchive
+from crop_manifest import CropManifest, chain_description, image_key
+from cropping import CROP_FORMATS, CropEncoder, compare_encoders, crop_bounds, crop_file_name, write_crop
+from decode_cache import DecodeCache
+from filters import FilterChain, StageCache, BUILTIN_FILTERS
+from image_source import ImageSource, set_spill_dir, supports_reduced_decode
+from process_pool import spawn_executor
+from session_state import SessionState
+from thumbnail_store import ThumbnailStore
+from timing import timers
+
+
+class ImageView(QGraphicsView):
+    """View of the opened image, with one pixmap item per tile of a pyramid level.
+
+    The scene is in full resolution image coordinates: tiles of a coarser level are
+    placed and scaled to the area they cover, and zoom and panning are the view
+    transform. Mouse positions are mapped to image coordinates through it.
+    """
+    mouse_clicked = pyqtSignal(int, int)  # Image coordinates
+    mouse_moved = pyqtSignal(int, int)  # Image coordinates
 
     def __init__(self, parent=None):
         super().__init__(parent)
+        self.setScene(QGraphicsScene(self))
         self.setMouseTracking(True)
+        self.setFrameShape(QFrame.NoFrame)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setTransformationAnchor(QGraphicsView.NoAnchor)
+        self.setResizeAnchor(QGraphicsView.NoAnchor)
+        self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         self.mouse_pos = None
         self.crop_size = 100
-        self.zoom_factor = 1.0
-        self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
-        self.setAlignment(Qt.AlignCenter)
-        # Transformation parameters
-        self.scale_x = None
-        self.scale_y = None
-        self.x_offset_label = None
-        self.y_offset_label = None
-        self.x_offset_image = None
-        self.y_offset_image = None
+        self.tile_items = {}  # (level, tile x, tile y) -> pixmap item
 
     def set_crop_size(self, size):
         """Set the size of the crop square."""
         self.crop_size = size
 
-    def set_zoom_factor(self, zoom):
-        """Set the zoom factor for the image display."""
-        self.zoom_factor = zoom
-        self.update()
-
-    def set_transformation_params(self, scale_x, scale_y, x_offset_label, y_offset_label, x_offset_image,
-                                  y_offset_image):
-        """Set parameters for coordinate transformation between image and label."""
-        self.scale_x = scale_x
-        self.scale_y = scale_y
-        self.x_offset_label = x_offset_label
-        self.y_offset_label = y_offset_label
-        self.x_offset_image = x_offset_image
-        self.y_offset_image = y_offset_image
+    def set_image_size(self, width, height):
+        """Start showing a new image of the given full resolution size."""
+        self.clear_tiles()
+        self.scene().setSceneRect(0, 0, width, height)
+
+    def clear_tiles(self):
+        """Remove every tile item."""
+        for item in self.tile_items.values():
+            self.scene().removeItem(item)
+        self.tile_items.clear()
+
+    def show_tiles(self, level, tiles, tile_size, tile_pixmap):
+        """Show the given (tile x, tile y) tiles of a level and drop the other tile items.
+
+        Only tiles without an item yet are fetched with tile_pixmap(level, tile x, tile y).
+        """
+        factor = 2 ** level
+        keys = {(level, tile_x, tile_y) for tile_x, tile_y in tiles}
+        for key in keys - self.tile_items.keys():
+            _, tile_x, tile_y = key
+            item = self.scene().addPixmap(tile_pixmap(*key))
+            item.setTransformationMode(Qt.SmoothTransformation)
+            item.setPos(tile_x * tile_size * factor, tile_y * tile_size * factor)
+            item.setScale(factor)
+            self.tile_items[key] = item
+        # Added before the old tiles are removed, so a level change never shows a gap
+        for key in self.tile_items.keys() - keys:
+            self.scene().removeItem(self.tile_items.pop(key))
+
+    def show_region(self, x, y, width, height, scale):
+        """Show the image area starting at (x, y) at a scale of view pixels per image pixel."""
+        self.setTransform(QTransform.fromScale(scale, scale))
+        # An area smaller than the view is centred, as the scene rect is aligned in the view
+        self.centerOn(x + width / 2, y + height / 2)
+        self.viewport().update()
+
+    def image_position(self, pos):
+        """Map a view position to image coordinates, or None outside the image."""
+        point = self.mapToScene(pos)
+        if not self.scene().sceneRect().contains(point):
+            return None
+        return int(point.x()), int(point.y())
+
+    def crop_rect(self, pos):
+        """Return the crop square under a view position, in view coordinates, or None."""
+        if pos is None or not self.tile_items:
+            return None
+        point = self.mapToScene(pos)
+        if not self.scene().sceneRect().contains(point):
+            return None
+        half = self.crop_size / 2
+        return self.mapFromScene(QRectF(point.x() - half, point.y() - half, self.crop_size,
+                                        self.crop_size)).boundingRect()
 
     def mouseMoveEvent(self, event):
         """Track mouse movement to update the crop rectangle."""
+        old_rect = self.crop_rect(self.mouse_pos)
         # Update mouse position
         self.mouse_pos = event.pos()
-        self.update()  # Redraw the yellow rectangle
+        new_rect = self.crop_rect(self.mouse_pos)
+
+        # Only repaint where the yellow rectangle (and its size label) was and will be
+        dirty = QRect()
+        for rect in (old_rect, new_rect):
+            if rect is not None:
+                dirty = dirty.united(rect.adjusted(-2, -2, 2, 2))
+        if not dirty.isNull():
+            self.viewport().update(dirty)
+        position = self.image_position(self.mouse_pos)
+        if position is not None:
+            self.mouse_moved.emit(*position)
 
     def mousePressEvent(self, event):
         """Handle mouse click events."""
         if event.button() == Qt.LeftButton:
-            # Emit signal with click coordinates
-            self.mouse_clicked.emit(event.x(), event.y())
+            position = self.image_position(event.pos())
+            if position is not None:
+                # Emit signal with the clicked image coordinates
+                self.mouse_clicked.emit(*position)
 
-    def paintEvent(self, event):
-        """Custom paint event to draw the crop rectangle."""
-        super().paintEvent(event)
-        if self.mouse_pos and self.pixmap() and self.scale_x and self.scale_y:
-            painter = QPainter(self)
-            painter.setPen(QPen(QColor("yellow"), 2, Qt.SolidLine))
+    def wheelEvent(self, event):
+        """Do not scroll, the offsets are set by the window."""
+        event.ignore()
 
-            label_x = self.mouse_pos.x()
-            label_y = self.mouse_pos.y()
-
-            # Adjust for label offsets
-            label_x_adj = label_x - self.x_offset_label
-            label_y_adj = label_y - self.y_offset_label
-
-            # Check if the mouse is within the pixmap area
-            pixmap_width = self.pixmap().width()
-            pixmap_height = self.pixmap().height()
-            if 0 <= label_x_adj <= pixmap_width and 0 <= label_y_adj <= pixmap_height:
-                # Map mouse position to image coordinates
-                image_x = label_x_adj / self.scale_x + self.x_offset_image
-                image_y = label_y_adj / self.scale_y + self.y_offset_image
-
-                # Calculate crop rectangle in image coordinates
-                crop_half_size = self.crop_size / 2
-                x_start = image_x - crop_half_size
-                y_start = image_y - crop_half_size
-                x_end = image_x + crop_half_size
-                y_end = image_y + crop_half_size
-
-                # Map crop rectangle to label coordinates
-                label_x_start = (x_start - self.x_offset_image) * self.scale_x + self.x_offset_label
-                label_y_start = (y_start - self.y_offset_image) * self.scale_y + self.y_offset_label
-                label_x_end = (x_end - self.x_offset_image) * self.scale_x + self.x_offset_label
-                label_y_end = (y_end - self.y_offset_image) * self.scale_y + self.y_offset_label
-
-                rect = QRectF(label_x_start, label_y_start, label_x_end - label_x_start, label_y_end - label_y_start)
-                painter.drawRect(rect)
-
-                # Draw the crop size inside the yellow square
-                painter.drawText(rect, Qt.AlignRight, str(self.crop_size) + "px ")
-
-            painter.end()
-
-
-class Filter:
-    """Base class for filters."""
-    def __init__(self, name, icon=None):
-        self.name = name
-        self.icon = icon  # Icon associated with the filter
+    def keyPressEvent(self, event):
+        """Leave the navigation keys to the window."""
+        event.ignore()
 
-    def apply(self, image):
-        """Apply the filter to the image. Override in subclasses."""
-        return image
+    def drawForeground(self, painter, rect):
+        """Draw the crop rectangle, in view pixels so its outline and label keep their size."""
+        crop_rect = self.crop_rect(self.mouse_pos)
+        if crop_rect is None:
+            return
+        painter.save()
+        painter.resetTransform()
+        painter.setPen(QPen(QColor("yellow"), 2, Qt.SolidLine))
+        painter.drawRect(crop_rect)
 
+        # Draw the crop size inside the yellow square
+        painter.drawText(crop_rect, Qt.AlignRight, str(self.crop_size) + "px ")
+        painter.restore()
 
-# Predefined filters using OpenCV functions
 
-class GrayscaleFilter(Filter):
-    """Convert image to grayscale."""
-    def __init__(self):
-        super().__init__('Grayscale', icon='icons/contrast-circle.svg')
+class CropQueue(QObject):
+    """Bounded pool of worker threads that filter, encode and write crops.
 
-    def apply(self, image):
-        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    At most ``max_pending`` crops are queued; submitting more waits for the oldest
+    to finish, so a slow disk slows down clicking instead of filling up memory.
+    """
+    progress = pyqtSignal(int, int, int)  # pending, saved, failed
+    crop_saved = pyqtSignal(str)  # Path of the written crop
+    crop_failed = pyqtSignal(str, str)  # Path of the crop, error message
+    _finished = pyqtSignal(object)  # Future, delivered on the GUI thread
 
+    def __init__(self, max_workers=None, max_pending=32, parent=None):
+        super().__init__(parent)
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or min(4, os.cpu_count() or 1),
+                                           thread_name_prefix='crop')
+        self.pending = {}  # Future -> path of its crop
+        self.saved = 0
+        self.failed = 0
+        self._finished.connect(self._handle_finished)
+
+    def submit(self, crop, filter_chain, crop_path, encoder=None, sink=None):
+        """Queue a crop for filtering and writing."""
+        # Backpressure: wait for the disk to catch up when the queue is full
+        not_done = {future for future in self.pending if not future.done()}
+        while len(not_done) >= self.max_pending:
+            _, not_done = wait(not_done, return_when=FIRST_COMPLETED)
+
+        future = self.executor.submit(write_crop, crop, filter_chain, crop_path, encoder, sink)
+        self.pending[future] = crop_path
+        future.add_done_callback(self._finished.emit)
+        self.progress.emit(len(self.pending), self.saved, self.failed)
+
+    def _handle_finished(self, future):
+        """Update the counters when a crop is done."""
+        crop_path = self.pending.pop(future)
+        error = future.exception()
+        if error is None:
+            self.saved += 1
+            self.crop_saved.emit(crop_path)
+        else:
+            self.failed += 1
+            self.crop_failed.emit(crop_path, str(error))
+        self.progress.emit(len(self.pending), self.saved, self.failed)
 
-class BlurFilter(Filter):
-    """Apply Gaussian blur to the image."""
-    def __init__(self):
-        super().__init__('Gaussian Blur', icon='icons/blur.svg')
+    def drain(self):
+        """Wait for the queued crops to be written."""
+        wait(list(self.pending))
 
-    def apply(self, image):
-        return cv2.GaussianBlur(image, (5, 5), 0)
+    def shutdown(self):
+        """Wait for the queued crops to be written and stop the workers."""
+        self.executor.shutdown(wait=True)
 
 
-class CannyEdgeFilter(Filter):
-    """Apply Canny edge detection."""
-    def __init__(self):
-        super().__init__('Canny Edge Detection', icon='icons/image-filter-hdr.svg')
+class GridCropJob(QObject):
+    """Crops every window of a grid in a pool of worker processes.
 
-    def apply(self, image):
-        if len(image.shape) == 3:
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        return cv2.Canny(image, 100, 200)
+    Workers read, filter and encode the windows in chunks straight from the memory-mapped
+    pixels. Only a few chunks are in flight at a time, so memory stays flat however
+    many windows the grid has.
+    """
+    progress = pyqtSignal(int, int)  # windows done, total
+    finished = pyqtSignal(int, bool, str)  # crops written, cancelled, error message
+    _chunk_done = pyqtSignal(object)  # Future, delivered on the GUI thread
 
+    def __init__(self, image_path, image_source, windows, total, crop_size, filters, output_folder,
+                 encoder, manifest, sink=None, max_workers=None, chunk_size=64, parent=None):
+        super().__init__(parent)
+        self.image_path = image_path
+        # Held until the job finishes: dropping the source would delete the pixels file the workers map
+        self.image_source = image_source
+        self.pixels_path = image_source.pixels_path
+        self.chunks = chunked(windows, chunk_size)  # Left and top edges of the windows
+        self.total = total
+        self.crop_size = crop_size
+        self.filters = filters
+        self.output_folder = output_folder
+        self.encoder = encoder
+        self.manifest = manifest
+        self.sink = sink
+        max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = 2 * max_workers
+        self.executor = spawn_executor(max_workers)
+        self.pending = {}  # Future -> number of windows in its chunk
+        self.done = 0
+        self.written = 0
+        self.cancelled = False
+        self.error = ''
+        self.running = True
+        self._chunk_done.connect(self._handle_chunk_done)
+
+    def start(self):
+        """Start the first chunks; the others follow as chunks finish."""
+        self._submit_chunks()
+        if not self.pending:
+            self._finish()
+
+    def _submit_chunks(self):
+        """Submit chunks until max_pending are in flight or the grid is exhausted."""
+        while not self.cancelled and len(self.pending) < self.max_pending:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return
+            future = self.executor.submit(crop_chunk, self.image_path, self.pixels_path, chunk, self.crop_size,
+                                          self.filters, self.output_folder, self.encoder, self.sink is not None,
+                                          grid=True)
+            self.pending[future] = len(chunk)
+            future.add_done_callback(self._chunk_done.emit)
+
+    def _handle_chunk_done(self, future):
+        """Count a finished chunk and keep the workers busy."""
+        self.done += self.pending.pop(future)
+        if not future.cancelled():
+            error = future.exception()
+            if error is not None:
+                if not self.error:
+                    self.error = str(error)
+                self.cancel()
+            else:
+                # Workers cannot share the archive and the manifest, this process appends
+                # their crops and records
+                records, crops = future.result()
+                for name, data in crops or ():
+                    self.sink.write(name, data)
+                self.manifest.add_all(records)
+                self.written += len(records)
+        self.progress.emit(self.done, self.total)
+        self._submit_chunks()
+        if not self.pending:
+            self._finish()
+
+    def cancel(self):
+        """Stop after the chunks that are already running."""
+        self.cancelled = True
+        for future in self.pending:
+            future.cancel()
+
+    def _finish(self):
+        # The progress dialog processes events while updating, so the last chunks can
+        # be delivered inside the handling of an earlier one; finish only once
+        if not self.running:
+            return
+        self.running = False
+        self.executor.shutdown(wait=False)
+        self.image_source = None
+        self.finished.emit(self.written, self.cancelled, self.error)
 
-class ThresholdFilter(Filter):
-    """Apply binary thresholding."""
-    def __init__(self):
-        super().__init__('Threshold', icon='icons/image-filter-center-focus.svg')
 
-    def apply(self, image):
-        if len(image.shape) == 3:
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        _, thresh = cv2.threshold(image, 127, 255, cv2.THRESH_BINARY)
-        return thresh
+# Files listed by a folder session
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp', '.jp2', '.npy')
 
 
-class LaplacianFilter(Filter):
-    """Apply Laplacian operator."""
-    def __init__(self):
-        super().__init__('Laplacian', icon='icons/image-filter-drama.svg')
+def close_image_source(future):
+    """Close the image source of a finished load, if it succeeded."""
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
 
-    def apply(self, image):
-        return cv2.Laplacian(image, cv2.CV_64F)
 
+def bgr_qimage(image):
+    """Wrap a contiguous BGR uint8 array in a QImage without copying the pixels.
 
-class SobelFilter(Filter):
-    """Apply Sobel operator."""
-    def __init__(self):
-        super().__init__('Sobel', icon='icons/image-filter-tilt-shift.svg')
+    The QImage points into the array memory, so the array is kept as an attribute of
+    the QImage to live at least as long as it.
+    """
+    image = np.ascontiguousarray(image)
+    qimg = QImage(image.data, image.shape[1], image.shape[0], image.strides[0], QImage.Format_BGR888)
+    qimg.ndarray = image
+    return qimg
 
-    def apply(self, image):
-        grad_x = cv2.Sobel(image, cv2.CV_64F, 1, 0)
-        grad_y = cv2.Sobel(image, cv2.CV_64F, 0, 1)
-        grad = cv2.sqrt(grad_x ** 2 + grad_y ** 2)
-        return grad
 
+class PixmapTileCache:
+    """LRU cache of rendered tile pixmaps, keyed by (pyramid level, tile x, tile y).
 
-class ErosionFilter(Filter):
-    """Apply morphological erosion."""
-    def __init__(self):
-        super().__init__('Erosion', icon='icons/image-filter-hdr.svg')
+    The cache is bounded by the memory used by the pixmaps rather than by their count.
+    """
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self._pixmaps = OrderedDict()
 
-    def apply(self, image):
-        kernel = np.ones((5, 5), np.uint8)
-        return cv2.erode(image, kernel, iterations=1)
+    @staticmethod
+    def _pixmap_bytes(pixmap):
+        return pixmap.width() * pixmap.height() * pixmap.depth() // 8
 
+    def get(self, key):
+        """Return the cached pixmap for key, or None."""
+        pixmap = self._pixmaps.get(key)
+        if pixmap is not None:
+            self._pixmaps.move_to_end(key)
+        return pixmap
 
-class DilationFilter(Filter):
-    """Apply morphological dilation."""
-    def __init__(self):
-        super().__init__('Dilation', icon='icons/image-filter-hdr.svg')
+    def put(self, key, pixmap):
+        """Cache a pixmap, evicting the least recently used ones over the budget."""
+        if key in self._pixmaps:
+            self.used_bytes -= self._pixmap_bytes(self._pixmaps.pop(key))
+        self._pixmaps[key] = pixmap
+        self.used_bytes += self._pixmap_bytes(pixmap)
+        while self.used_bytes > self.max_bytes and len(self._pixmaps) > 1:
+            _, evicted = self._pixmaps.popitem(last=False)
+            self.used_bytes -= self._pixmap_bytes(evicted)
 
-    def apply(self, image):
-        kernel = np.ones((5, 5), np.uint8)
-        return cv2.dilate(image, kernel, iterations=1)
+    def clear(self):
+        """Drop every cached pixmap."""
+        self._pixmaps.clear()
+        self.used_bytes = 0
 
 
 class ImageCropper(QMainWindow):
     """Main application window."""
+    preview_ready = pyqtSignal(object)  # Future of a filter preview job
+    image_loaded = pyqtSignal(object)  # Future of a full resolution decode
     def __init__(self):
         super().__init__()
         self.setWindowTitle("ImageCropper")
@@ -221,25 +389,45 @@ class ImageCropper(QMainWindow):
         self.x_offset = 0
         self.y_offset = 0
         self.rect_cursor = None
-        self.block_size = 800  # Initial block size
+        self.mini_map_scale = None  # Mini-map pixels per image pixel
+        self.tile_cache = PixmapTileCache()  # Rendered tiles of the opened image
         self.image_size = None  # Size of the full image
         self.current_block = None  # Currently displayed image block
-        self.full_image = None  # The full image
-
-        # Transformation parameters
-        self.scale_x = None
-        self.scale_y = None
-        self.x_offset_label = None
-        self.y_offset_label = None
-        self.x_offset_image = None
-        self.y_offset_image = None
+        self.image_source = None  # Tiled access to the opened image
 
         # Filter settings
         self.selected_filters = []  # List of selected filters
+        self.filter_chain = FilterChain(self.selected_filters)  # Compiled selected filters
 
         # Initialize settings and recent files
         self.settings = QSettings('YourCompany', 'ImageCropper')
-        self.recent_files = self.settings.value('recent_files', [], type=list)
+        # State that changes with every crop (recent files, viewports, crop counts) is kept
+        # in memory and journaled to disk in batches, see flush_session_state
+        data_root = QStandardPaths.writableLocation(QStandardPaths.GenericDataLocation)
+        self.session_state = SessionState(os.path.join(data_root, 'ImageCropper'))
+        if 'recent_files' not in self.session_state:
+            # Recent files used to be stored in the settings
+            self.session_state.set('recent_files', self.settings.value('recent_files', [], type=list))
+        self.recent_files = self.session_state.get('recent_files')
+        self.cache_root = os.path.join(QStandardPaths.writableLocation(QStandardPaths.GenericCacheLocation),
+                                       'ImageCropper')
+        # Decoded images and zoom levels are mapped from files on disk, not from /tmp (often RAM)
+        set_spill_dir(os.path.join(self.cache_root, 'spill'))
+        self.decode_cache = None  # Decoded images kept on disk between sessions, if enabled
+        self.thumbnail_store = ThumbnailStore(os.path.join(self.cache_root, 'thumbnails'))
+        try:
+            self.crop_encoder = CropEncoder(self.settings.value('crop_format', 'PNG'),
+                                            self.settings.value('crop_level', None))
+        except ValueError:
+            self.crop_encoder = CropEncoder()
+        # Crops are appended to tar shards in the crop folder instead of one file each, if enabled
+        self.use_crop_archive = self.settings.value('crop_archive', False, type=bool)
+        self.crop_archive = None  # Open archive of the crop folder
+        self.crop_manifests = {}  # Crop folder -> record of its crops
+        self.manifest_entries = {}  # Crop path -> (manifest, record) of the crops being written
+        self.image_key = None  # Identity of the opened image file in the manifest
+        self.grid_job = None  # Running grid crop
+        self.grid_progress = None  # Its progress dialog
 
         # Create the toolbar
         self.toolbar = self.addToolBar('Main Toolbar')
@@ -261,6 +449,8 @@ class ImageCropper(QMainWindow):
         # Add the mini-map view to the left side
         self.map_view = QGraphicsView(self)
         self.map_view.setFixedSize(300, 300)
+        self.map_view.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.map_view.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
         self.left_side_layout.addWidget(self.map_view)
 
         self.scene = QGraphicsScene(self)
@@ -281,6 +471,13 @@ class ImageCropper(QMainWindow):
         self.flowchart_scroll_area.setWidget(self.flowchart_widget)
         self.left_side_layout.addWidget(self.flowchart_scroll_area)
 
+        # Add the live preview of the filters under the flowchart
+        self.preview_label = QLabel()
+        self.preview_label.setFixedSize(300, 300)
+        self.preview_label.setAlignment(Qt.AlignCenter)
+        self.preview_label.setToolTip('Filtered crop under the cursor')
+        self.left_side_layout.addWidget(self.preview_label)
+
         # Add the filters icon to the top of the flowchart
         filters_icon = QLabel()
         filters_icon.setPixmap(QIcon('icons/filter-multiple-outline.svg').pixmap(24, 24))
@@ -288,27 +485,79 @@ class ImageCropper(QMainWindow):
         self.left_side_layout.insertWidget(1, filters_icon, alignment=Qt.AlignCenter)
 
         # Right side (image)
-        # Create the label to display the image
-        self.image_label = ImageLabel(self)
-        self.image_label.setFocusPolicy(Qt.ClickFocus)
-        self.image_label.mouse_clicked.connect(self.handle_mouse_click)
-        self.central_layout.addWidget(self.image_label)
+        # Create the view to display the image
+        self.image_view = ImageView(self)
+        self.image_view.setFocusPolicy(Qt.ClickFocus)
+        self.image_view.mouse_clicked.connect(self.handle_mouse_click)
+        self.image_view.mouse_moved.connect(self.handle_mouse_move)
+        self.central_layout.addWidget(self.image_view)
 
         # Set stretch factors
         self.central_layout.setStretch(0, 0)  # Left side (mini-map and flowchart)
         self.central_layout.setStretch(1, 1)  # Image
 
-        # Set initial crop size and zoom factor
-        self.image_label.set_crop_size(self.crop_size)
-        self.image_label.set_zoom_factor(self.zoom_factor)
+        # Set initial crop size
+        self.image_view.set_crop_size(self.crop_size)
 
         self.map_view.mousePressEvent = self.handle_mini_map_click
 
+        # Crops are filtered and written in the background, progress shows in the status bar
+        self.crop_queue = CropQueue(parent=self)
+        self.crop_queue.progress.connect(self.update_crop_status)
+        self.crop_queue.crop_saved.connect(self.handle_crop_saved)
+        self.crop_queue.crop_failed.connect(self.handle_crop_failed)
+        self.crop_status_label = QLabel()
+        self.statusBar().addPermanentWidget(self.crop_status_label)
+
+        # Render requests are merged into at most one frame per display refresh
+        refresh_rate = QApplication.primaryScreen().refreshRate() or 60
+        self.frame_interval = max(1, int(1000 / refresh_rate))
+        self.render_timer = QTimer(self)
+        self.render_timer.setSingleShot(True)
+        self.render_timer.timeout.connect(self.display_image)
+        self.last_render = QElapsedTimer()
+        self.skipped_frames = 0
+        self.render_status_label = QLabel()
+        self.statusBar().addPermanentWidget(self.render_status_label)
+
+        # Stage timings, refreshed while enabled
+        self.timings_label = QLabel()
+        self.statusBar().addWidget(self.timings_label)
+        self.timings_timer = QTimer(self)
+        self.timings_timer.timeout.connect(self.update_timings)
+
+        # Session state is written in batches; a crash loses at most one interval
+        self.session_timer = QTimer(self)
+        self.session_timer.timeout.connect(self.flush_session_state)
+        self.session_timer.start(2000)
+
         # Initially, hide the flowchart (since no filters are selected)
         self.flowchart_widget.hide()
         self.flowchart_scroll_area.hide()
         filters_icon.hide()
         self.filters_icon = filters_icon  # Save reference to toggle visibility later
+        self.preview_label.hide()
+
+        # The filter preview runs on a single background thread; only the latest
+        # cursor position is kept while a preview is being computed
+        self.preview_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='preview')
+        self.preview_cache = StageCache()  # Outputs of each filter chain prefix
+        self.preview_running = False
+        self.preview_position = None  # Latest requested crop centre
+        self.last_preview_position = None  # Crop centre of the shown preview
+        self.preview_ready.connect(self.show_filter_preview)
+
+        # Images open from a reduced decode; full resolution is decoded on this thread
+        self.load_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='load')
+        self.load_future = None  # Full resolution decode of the opened image
+        self.image_loaded.connect(self.show_full_resolution)
+
+        # Folder session: the images of a folder, opened one after the other. The neighbours
+        # of the current image are decoded in the background so switching is instant.
+        self.session_images = []
+        self.session_index = None
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+        self.prefetched = {}  # Image path -> future of its full resolution ImageSource
 
     def create_actions(self):
         """Create actions for the toolbar."""
@@ -333,6 +582,31 @@ class ImageCropper(QMainWindow):
         folder_action.triggered.connect(self.change_destination_folder)
         self.toolbar.addAction(folder_action)
 
+        # Folder session actions
+        open_folder_action = QAction(QIcon('icons/image-plus-outline.svg'), 'Open Folder', self)
+        open_folder_action.setShortcut('Ctrl+Shift+O')
+        open_folder_action.triggered.connect(self.open_folder)
+        self.addAction(open_folder_action)
+
+        previous_icon = QIcon('icons/arrow-left-bold-box-outline.svg')
+        previous_action = QAction(previous_icon, 'Previous Image', self)
+        previous_action.setShortcut('PgUp')
+        previous_action.triggered.connect(self.previous_image)
+        self.toolbar.addAction(previous_action)
+
+        next_icon = QIcon('icons/arrow-right-bold-box-outline.svg')
+        next_action = QAction(next_icon, 'Next Image', self)
+        next_action.setShortcut('PgDown')
+        next_action.triggered.connect(self.next_image)
+        self.toolbar.addAction(next_action)
+
+        # Crop format action
+        format_icon = QIcon('icons/file-edit-outline.svg')
+        format_action = QAction(format_icon, 'Crop Format', self)
+        format_action.setShortcut('Ctrl+E')
+        format_action.triggered.connect(self.change_crop_format)
+        self.toolbar.addAction(format_action)
+
         # Zoom in action
         zoom_in_icon = QIcon('icons/magnify-plus-outline.svg')
         zoom_in_action = QAction(zoom_in_icon, 'Zoom In', self)
@@ -359,6 +633,34 @@ class ImageCropper(QMainWindow):
         self.toolbar_filter_action.triggered.connect(self.open_filter_dialog)
         self.toolbar.addAction(self.toolbar_filter_action)
 
+        # Performance timings action
+        timings_icon = QIcon('icons/timeline-plus-outline.svg')
+        self.timings_action = QAction(timings_icon, 'Performance Timings', self)
+        self.timings_action.setShortcut('Ctrl+T')
+        self.timings_action.setCheckable(True)
+        self.timings_action.toggled.connect(self.toggle_timings)
+        self.toolbar.addAction(self.timings_action)
+
+        # Grid crop action (shortcut only)
+        grid_action = QAction('Grid Crop', self)
+        grid_action.setShortcut('Ctrl+G')
+        grid_action.triggered.connect(self.grid_crop)
+        self.addAction(grid_action)
+
+        # Timing trace action (shortcut only)
+        trace_action = QAction('Record Timing Trace', self)
+        trace_action.setShortcut('Ctrl+Shift+T')
+        trace_action.triggered.connect(self.record_timing_trace)
+        self.addAction(trace_action)
+
+        # Decode cache action (shortcut only), remembered between sessions
+        cache_action = QAction('Cache Decoded Images', self)
+        cache_action.setShortcut('Ctrl+Shift+K')
+        cache_action.setCheckable(True)
+        cache_action.toggled.connect(self.toggle_decode_cache)
+        cache_action.setChecked(self.settings.value('decode_cache', False, type=bool))
+        self.addAction(cache_action)
+
         # todo: finish to add the capability to use Computer vision IA inference on the cropped image
         # Computer vision snipped action
         cv_icon = QIcon('icons/brain.svg')
@@ -378,6 +680,38 @@ class ImageCropper(QMainWindow):
         """Open the Computer Vision Snippet Dialog."""
         QMessageBox.information(self, "Work in Progress", "I am working on this, wait for the next update")
 
+    def toggle_timings(self, enabled):
+        """Turn the per-stage timers and their status bar summary on or off."""
+        timers.enabled = enabled
+        timers.reset()
+        if enabled:
+            self.timings_timer.start(1000)
+        else:
+            self.timings_timer.stop()
+            timers.stop_trace()
+            self.timings_label.clear()
+
+    def update_timings(self):
+        """Show the rolling stage percentiles in the status bar."""
+        self.timings_label.setText(timers.summary())
+
+    def record_timing_trace(self):
+        """Enable the timers and append every measurement to a JSON-lines file."""
+        path, _ = QFileDialog.getSaveFileName(self, "Save timing trace", "imagecropper_trace.jsonl",
+                                              "JSON Lines (*.jsonl)")
+        if path:
+            timers.start_trace(path)
+            self.timings_action.setChecked(True)
+            self.statusBar().showMessage(f"Recording timing trace to {path}", 5000)
+
+    def toggle_decode_cache(self, enabled):
+        """Keep decoded images in an on-disk cache, so reopening them skips the decode."""
+        self.settings.setValue('decode_cache', enabled)
+        if enabled:
+            self.decode_cache = DecodeCache(os.path.join(self.cache_root, 'decoded'))
+        else:
+            self.decode_cache = None
+
     def show_information(self):
         """Display the information dialog."""
         info_dialog = QDialog(self)
@@ -414,11 +748,18 @@ class ImageCropper(QMainWindow):
         shortcuts_text = """
         <ul>
             <li><b>Ctrl+O</b>: Open Image</li>
+            <li><b>Ctrl+Shift+O</b>: Open Folder (work through all its images)</li>
+            <li><b>Page Up / Page Down</b>: Previous / Next Image of the folder</li>
             <li><b>Ctrl+Shift+C</b>: Set Crop Size</li>
             <li><b>Ctrl+D</b>: Change Destination Folder</li>
+            <li><b>Ctrl+E</b>: Crop Format</li>
+            <li><b>Ctrl+G</b>: Grid Crop (crop every window of a grid)</li>
             <li><b>Ctrl++</b>: Zoom In</li>
             <li><b>Ctrl+-</b>: Zoom Out</li>
             <li><b>Ctrl+F</b>: Apply Filters</li>
+            <li><b>Ctrl+T</b>: Show Performance Timings</li>
+            <li><b>Ctrl+Shift+T</b>: Record Timing Trace</li>
+            <li><b>Ctrl+Shift+K</b>: Cache Decoded Images</li>
             <li><b>Arrow Keys</b>: Move Image View</li>
             <li><b>Ctrl + Arrow Keys</b>: Move Image View Faster</li>
         </ul>
@@ -435,8 +776,10 @@ class ImageCropper(QMainWindow):
         tools_text = """
         <ul>
             <li><b>Open Image</b>: Load a new image to work with.</li>
+            <li><b>Previous/Next Image</b>: Move through the images of an opened folder.</li>
             <li><b>Set Crop Size</b>: Define the size of the area to crop.</li>
             <li><b>Change Destination Folder</b>: Set where cropped images are saved.</li>
+            <li><b>Crop Format</b>: Choose the file format of the crops and compare their speed and size.</li>
             <li><b>Zoom In/Out</b>: Adjust the zoom level of the image view.</li>
             <li><b>Apply Filters</b>: Select and arrange filters to apply to the cropped images.</li>
             <li><b>Information</b>: View application commands and functionalities.</li>
@@ -458,7 +801,7 @@ class ImageCropper(QMainWindow):
                                             value=self.crop_size, min=10, max=1000)
         if ok:
             self.crop_size = crop_size
-            self.image_label.set_crop_size(crop_size)  # Update crop size in image label
+            self.image_view.set_crop_size(crop_size)  # Update crop size in image view
 
     def change_destination_folder(self):
         """Open a dialog to select a new destination folder."""
@@ -470,19 +813,119 @@ class ImageCropper(QMainWindow):
         else:
             QMessageBox.warning(self, "Operation Cancelled", "The destination folder was not changed.")
 
+    def change_crop_format(self):
+        """Open a dialog to choose the file format of the crops."""
+        dialog = CropFormatDialog(self.crop_encoder, self.use_crop_archive, self.sample_crops, self)
+        if dialog.exec_() == QDialog.Accepted:
+            self.crop_encoder = dialog.get_encoder()
+            self.use_crop_archive = dialog.archive_check.isChecked()
+            self.settings.setValue('crop_format', self.crop_encoder.format)
+            self.settings.setValue('crop_level', self.crop_encoder.level)
+            self.settings.setValue('crop_archive', self.use_crop_archive)
+
+    def crop_sink(self):
+        """Return the archive of the crop folder the crops go to, or None for one file per crop."""
+        if not self.use_crop_archive:
+            return None
+        if self.crop_archive is None or self.crop_archive.folder != self.crop_folder:
+            self.close_crop_archive()
+            self.crop_archive = CropArchive(self.crop_folder)
+        return self.crop_archive
+
+    def open_crop_manifest(self):
+        """Return the manifest of the crop folder, opening it if needed."""
+        manifest = self.crop_manifests.get(self.crop_folder)
+        if manifest is None:
+            manifest = self.crop_manifests[self.crop_folder] = CropManifest(self.crop_folder)
+        return manifest
+
+    def close_crop_archive(self):
+        """Close the open crop archive once its queued crops are written."""
+        if self.crop_archive is not None:
+            self.crop_queue.drain()
+            self.crop_archive.close()
+            self.crop_archive = None
+
+    def sample_crops(self, count=16):
+        """Return filtered crops at random positions of the image, to measure the encoders on."""
+        if self.image_source is None or self.image_source.is_preview:
+            return []
+        height, width = self.image_size
+        crops = []
+        for x, y in np.random.default_rng().integers(0, (width, height), size=(count, 2)):
+            x_start, y_start, x_end, y_end = crop_bounds(x, y, self.crop_size, self.image_size)
+            crop = self.image_source.read_region(x_start, y_start, x_end - x_start, y_end - y_start)
+            if crop.size:
+                crops.append(self.filter_chain.apply(crop))
+        return crops
+
+    def visible_region(self):
+        """Return the part of the image shown in the view as (x, y, width, height)."""
+        display_width, display_height = self.display_size()
+        return self.x_offset, self.y_offset, display_width, display_height
+
+    def grid_crop(self):
+        """Crop every crop_size window of a grid over the image or the visible area."""
+        if self.image_source is None or self.grid_job is not None:
+            return
+        if self.crop_folder is None:
+            QMessageBox.warning(self, "Error", "Destination folder not set.")
+            return
+        if self.image_source.is_preview:
+            self.statusBar().showMessage("Full resolution is still loading, try again in a moment.", 3000)
+            return
+
+        def window_count(stride, visible_only):
+            x_starts, y_starts = grid_axes(self.image_size, self.crop_size, stride,
+                                           self.visible_region() if visible_only else None)
+            return len(x_starts) * len(y_starts)
+
+        dialog = GridCropDialog(self.crop_size, window_count, self)
+        if dialog.exec_() != QDialog.Accepted:
+            return
+        stride = dialog.stride_spin.value()
+        region = self.visible_region() if dialog.visible_check.isChecked() else None
+        total = window_count(stride, region is not None)
+        if total == 0:
+            QMessageBox.warning(self, "Error", "No crop fits in the selected area.")
+            return
+
+        self.grid_job = GridCropJob(self.image_path, self.image_source,
+                                    grid_positions(self.image_size, self.crop_size, stride, region), total,
+                                    self.crop_size, list(self.filter_chain.filters), self.crop_folder,
+                                    self.crop_encoder, self.open_crop_manifest(), self.crop_sink(), parent=self)
+        self.grid_progress = QProgressDialog(f"Cropping {total} windows...", "Cancel", 0, total, self)
+        self.grid_progress.setWindowModality(Qt.WindowModal)
+        self.grid_progress.setMinimumDuration(0)
+        self.grid_progress.canceled.connect(self.grid_job.cancel)
+        self.grid_job.progress.connect(lambda done, _: self.grid_progress.setValue(done))
+        self.grid_job.finished.connect(self.handle_grid_finished)
+        self.grid_job.start()
+
+    def handle_grid_finished(self, written, cancelled, error):
+        """Close the grid crop progress and report the result."""
+        self.grid_progress.canceled.disconnect()
+        self.grid_progress.close()
+        self.grid_progress = None
+        self.grid_job = None
+        if error:
+            QMessageBox.critical(self, "Error", f"Grid crop failed after {written} crops:\n{error}")
+        elif cancelled:
+            self.statusBar().showMessage(f"Grid crop cancelled after {written} crops", 5000)
+        else:
+            self.statusBar().showMessage(f"Grid crop: {written} crops saved", 5000)
+
     def zoom_in(self):
         """Increase the zoom factor."""
         self.zoom_factor *= 1.2  # Increase zoom factor by 20%
-        self.image_label.set_zoom_factor(self.zoom_factor)
         self.zoom_label.setText(f"{int(self.zoom_factor * 100)}%")
-        self.display_image()
+        self.schedule_render()
 
     def zoom_out(self):
         """Decrease the zoom factor."""
         self.zoom_factor /= 1.2  # Decrease zoom factor by 20%
-        self.image_label.set_zoom_factor(self.zoom_factor)
         self.zoom_label.setText(f"{int(self.zoom_factor * 100)}%")
-        self.display_image()
+        self.schedule_render()
 
     def open_filter_dialog(self):
         """Open the filter selection dialog."""
@@ -490,6 +933,7 @@ class ImageCropper(QMainWindow):
         if filter_dialog.exec_() == QDialog.Accepted:
             # Update the selected filters
             self.selected_filters = filter_dialog.get_selected_filters()
+            self.filter_chain = FilterChain(self.selected_filters)
 
             # Change the toolbar icon color to green if any filter is active
             if self.selected_filters:
@@ -497,12 +941,18 @@ class ImageCropper(QMainWindow):
                 self.display_filters_flowchart()  # Update the flowchart
                 self.flowchart_widget.show()
                 self.flowchart_scroll_area.show()
+                self.preview_label.show()
                 # Show the filters icon
                 self.filters_icon.show()
+                # Refresh the preview, only the stages after the change run again
+                if self.preview_position is None:
+                    self.preview_position = self.last_preview_position
+                self.request_filter_preview()
             else:
                 self.toolbar_filter_action.setIcon(QIcon('icons/filter-menu-outline.svg'))
                 self.flowchart_widget.hide()
                 self.flowchart_scroll_area.hide()
+                self.preview_label.hide()
                 # Hide the filters icon
                 self.filters_icon.hide()
 
@@ -562,28 +1012,83 @@ class ImageCropper(QMainWindow):
                                                          options=options)
 
         if self.image_path:
-            # Load the full image once
-            self.full_image = cv2.imread(self.image_path, cv2.IMREAD_COLOR)
-            if self.full_image is None:
-                QMessageBox.critical(self, "Error", "Unable to open the selected image.")
-                return
+            self.end_session()
+            self.load_image()
 
-            self.image_size = self.full_image.shape[:2]  # (height, width)
+    def open_folder(self):
+        """Open every image of a folder as a session, starting with the first one."""
+        image_folder = QFileDialog.getExistingDirectory(self, "Select the folder of images to crop")
+        if not image_folder:
+            return
+        images = sorted(os.path.join(image_folder, name) for name in os.listdir(image_folder)
+                        if name.lower().endswith(IMAGE_EXTENSIONS))
+        if not images:
+            QMessageBox.critical(self, "Error", "No images found in the selected folder.")
+            return
 
-            # Reset offsets and zoom factor
-            self.x_offset = 0
-            self.y_offset = 0
-            self.zoom_factor = 1.0
-            self.image_label.set_zoom_factor(self.zoom_factor)
-            self.zoom_label.setText(f"{int(self.zoom_factor * 100)}%")
-            self.display_image()
-            self.setFocus()  # Ensure main window captures focus
+        self.crop_folder = QFileDialog.getExistingDirectory(self, "Select the destination folder for crops")
+        if not self.crop_folder:
+            QMessageBox.critical(self, "Error", "No folder selected for saving crops.")
+            return
 
-            # Add to recent files
-            self.add_to_recent_files(self.image_path)
+        self.end_session()
+        self.session_images = images
+        self.open_session_image(0)
+
+    def open_session_image(self, index):
+        """Show an image of the folder session."""
+        self.session_index = index
+        self.image_path = self.session_images[index]
+        self.load_image()
+        self.setWindowTitle(f"ImageCropper - {os.path.basename(self.image_path)} "
+                            f"({index + 1}/{len(self.session_images)})")
+
+    def next_image(self):
+        """Show the next image of the folder session."""
+        if self.session_index is not None and self.session_index + 1 < len(self.session_images):
+            self.open_session_image(self.session_index + 1)
+
+    def previous_image(self):
+        """Show the previous image of the folder session."""
+        if self.session_index is not None and self.session_index > 0:
+            self.open_session_image(self.session_index - 1)
+
+    def session_neighbours(self):
+        """Images worth keeping decoded: the previous one and the next two of the session."""
+        if self.session_index is None:
+            return []
+        indexes = (self.session_index - 1, self.session_index + 1, self.session_index + 2)
+        return [self.session_images[i] for i in indexes if 0 <= i < len(self.session_images)]
+
+    def prefetch_image(self, path):
+        """Decode an image and make its thumbnail, ready to be shown (prefetch thread)."""
+        image_source = ImageSource(path, cache=self.decode_cache)
+        if self.thumbnail_store.get(path) is None:
+            self.thumbnail_store.put(path, image_source.thumbnail(self.thumbnail_store.max_size))
+        return image_source
+
+    def prefetch_neighbours(self):
+        """Start decoding the neighbours of the current image and drop the other prefetched images."""
+        neighbours = self.session_neighbours()
+        for path in list(self.prefetched):
+            if path not in neighbours:
+                future = self.prefetched.pop(path)
+                if not future.cancel():
+                    future.add_done_callback(close_image_source)
+        for path in neighbours:
+            if path not in self.prefetched:
+                self.prefetched[path] = self.prefetch_executor.submit(self.prefetch_image, path)
+
+    def end_session(self):
+        """Leave the folder session, if any."""
+        self.session_images = []
+        self.session_index = None
+        self.prefetch_neighbours()
+        self.setWindowTitle("ImageCropper")
 
     def open_recent_file(self, image_path):
         """Open a recent image file."""
+        self.end_session()
         self.image_path = image_path
 
         # Find the crop_folder associated with this image
@@ -613,26 +1118,115 @@ class ImageCropper(QMainWindow):
                 QMessageBox.critical(self, "Error", "No folder selected for saving crops.")
                 return
 
-        # Load the full image once
-        self.full_image = cv2.imread(self.image_path, cv2.IMREAD_COLOR)
-        if self.full_image is None:
-            QMessageBox.critical(self, "Error", "Unable to open the selected image.")
-            return
+        self.load_image()
 
-        self.image_size = self.full_image.shape[:2]  # (height, width)
+    def load_image(self):
+        """Open self.image_path for tiled access and show it.
 
-        # Reset offsets and zoom factor
-        self.x_offset = 0
-        self.y_offset = 0
-        self.zoom_factor = 1.0
-        self.image_label.set_zoom_factor(self.zoom_factor)
-        self.zoom_label.setText(f"{int(self.zoom_factor * 100)}%")
-        self.display_image()
+        JPEGs show a reduced-size decode first; other formats are only decoded on a
+        background thread. The full resolution image is shown when ready (see
+        show_full_resolution). Images prefetched by a folder session are shown at full
+        resolution right away.
+        """
+        prefetched = self.prefetched.pop(self.image_path, None)
+        image_source = None
+        if prefetched is not None and prefetched.done() and prefetched.exception() is None:
+            image_source = prefetched.result()
+        else:
+            # Raw arrays and cached images are memory-mapped, which is already instant
+            reduction = None
+            if self.image_path.lower().endswith('.npy') or (
+                    self.decode_cache is not None and self.decode_cache.contains(self.image_path)):
+                reduction = 1
+            elif supports_reduced_decode(self.image_path):
+                reduction = 8
+            if reduction is not None:
+                try:
+                    with timers.stage('open preview'):
+                        image_source = ImageSource(self.image_path, reduction=reduction, cache=self.decode_cache)
+                except (ValueError, OSError):
+                    QMessageBox.critical(self, "Error", "Unable to open the selected image.")
+                    return
+
+        # Release the previously opened image, unless the session may come back to it
+        previous_source = self.image_source
+        if previous_source is not None:
+            if previous_source.path in self.session_neighbours() and not previous_source.is_preview:
+                kept = self.prefetched[previous_source.path] = Future()
+                kept.set_result(previous_source)
+            elif self.grid_job is not None and self.grid_job.image_source is previous_source:
+                # Released by the grid job once its workers are done with the pixels
+                pass
+            else:
+                previous_source.close()
+        self.image_source = image_source
+        self.preview_cache.clear()
+        self.last_preview_position = None
+
+        self.load_future = None
+        self.image_key = image_key(self.image_path)
+        if image_source is None or image_source.is_preview:
+            self.statusBar().showMessage("Loading full resolution...")
+            if prefetched is not None and not prefetched.done():
+                # Already being decoded by the prefetch thread
+                self.load_future = prefetched
+            else:
+                self.load_future = self.load_executor.submit(ImageSource, self.image_path, cache=self.decode_cache)
+            self.load_future.add_done_callback(self.image_loaded.emit)
+        self.prefetch_neighbours()
+        self.show_opened_image()
         self.setFocus()  # Ensure main window captures focus
 
         # Add to recent files
         self.add_to_recent_files(self.image_path)
 
+    def show_opened_image(self):
+        """Show self.image_source from its last viewport, or clear the view while it is loading."""
+        self.tile_cache.clear()
+        if self.image_source is None:
+            self.image_size = None
+            self.image_view.set_image_size(0, 0)
+            self.scene.clear()
+            self.rect_cursor = None
+            return
+        self.image_size = self.image_source.shape  # (height, width)
+        self.image_view.set_image_size(self.image_size[1], self.image_size[0])
+
+        # Go back to the last viewport of the image, or reset offsets and zoom factor
+        self.x_offset, self.y_offset, self.zoom_factor = self.image_state(self.image_path).get('viewport', (0, 0, 1.0))
+        self.zoom_label.setText(f"{int(self.zoom_factor * 100)}%")
+        self.build_mini_map()
+        self.display_image()
+
+    def show_full_resolution(self, future):
+        """Show the full resolution image once it is decoded, replacing the reduced preview if any."""
+        if future is not self.load_future:
+            # Another image was opened meanwhile
+            if future.exception() is None:
+                future.result().close()
+            return
+        self.load_future = None
+        error = future.exception()
+        if error is not None:
+            self.statusBar().clearMessage()
+            QMessageBox.critical(self, "Error", f"Unable to load the full resolution image.\n{error}")
+            return
+
+        preview = self.image_source
+        self.image_source = future.result()
+        self.statusBar().showMessage("Full resolution loaded", 3000)
+        if preview is None:
+            self.show_opened_image()
+            return
+        self.image_size = self.image_source.shape
+        self.image_view.set_image_size(self.image_size[1], self.image_size[0])
+        # The full size may differ slightly from the preview size rounded to the reduction
+        self.mini_map_scale *= preview.width / self.image_source.width
+        preview.close()
+        self.tile_cache.clear()
+        self.preview_cache.clear()
+        self.schedule_render()
+
     def add_to_recent_files(self, image_path):
         """Add the opened image to recent files."""
         from datetime import datetime
@@ -652,126 +1246,141 @@ class ImageCropper(QMainWindow):
         # Keep only the last 5 items
         self.recent_files = self.recent_files[:5]
 
-        # Save in settings
-        self.settings.setValue('recent_files', self.recent_files)
-
-    def display_image(self):
-        """Display the image in the image label."""
-        if self.image_path is None or self.full_image is None:
+        self.session_state.set('recent_files', self.recent_files)
+
+    def image_state(self, image_path):
+        """Return the session state of an image: last viewport and crop count."""
+        return self.session_state.get(f'image:{image_path}', {})
+
+    def update_image_state(self, image_path, **changes):
+        """Change the session state of an image; it is written by the next flush."""
+        state = dict(self.image_state(image_path))
+        state.update(changes)
+        self.session_state.set(f'image:{image_path}', state)
+
+    def flush_session_state(self):
+        """Append the session state changed since the last flush to its journal."""
+        with timers.stage('session flush'):
+            self.session_state.flush()
+
+    def schedule_render(self):
+        """Request a display_image call, merging requests that arrive within one frame."""
+        if self.render_timer.isActive():
+            # A frame is already pending and will use the latest offsets and zoom
+            self.skipped_frames += 1
+            self.render_status_label.setText(f"Frames skipped: {self.skipped_frames}")
             return
+        elapsed = self.last_render.elapsed() if self.last_render.isValid() else self.frame_interval
+        self.render_timer.start(max(0, self.frame_interval - elapsed))
 
-        # Get the size of the image_label in pixels
-        label_width = self.image_label.width()
-        label_height = self.image_label.height()
+    def view_scale(self):
+        """View pixels per image pixel: the zoom factor, but never less than fitting the whole image."""
+        fit_scale = min(self.image_view.width() / self.image_size[1], self.image_view.height() / self.image_size[0])
+        return max(self.zoom_factor, fit_scale)
 
-        # Calculate the size of the area to load from the image, considering the zoom factor
-        display_width = int(label_width / self.zoom_factor)
-        display_height = int(label_height / self.zoom_factor)
+    def display_size(self):
+        """Size of the image area shown in the view, in image pixels, as (width, height)."""
+        scale = self.view_scale()
+        return (min(int(self.image_view.width() / scale), self.image_size[1]),
+                min(int(self.image_view.height() / scale), self.image_size[0]))
 
-        # Ensure the display area does not exceed the image size
-        display_width = min(display_width, self.image_size[1])
-        display_height = min(display_height, self.image_size[0])
+    def display_image(self):
+        """Show the tiles of the visible area and move the view to it."""
+        self.render_timer.stop()
+        self.last_render.start()
+        if self.image_path is None or self.image_source is None:
+            return
+
+        display_width, display_height = self.display_size()
 
         # Adjust offsets if necessary
         self.x_offset = max(0, min(self.x_offset, self.image_size[1] - display_width))
         self.y_offset = max(0, min(self.y_offset, self.image_size[0] - display_height))
 
-        # Extract the required area from the image
-        img = self.full_image[self.y_offset:self.y_offset + display_height,
-                              self.x_offset:self.x_offset + display_width]
-
-        if img is None or img.size == 0:
-            return
-
-        # Convert image to RGB format
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
-        # Convert the image to a QImage
-        height, width, channel = img.shape
-        bytes_per_line = 3 * width
-        qimg = QImage(img.data, width, height, bytes_per_line, QImage.Format_RGB888)
-
-        # Scale the QImage according to the zoom factor
-        pixmap = QPixmap.fromImage(qimg)
-        scaled_pixmap = pixmap.scaled(label_width, label_height, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-
-        # Store the displayed pixmap size and offsets
-        displayed_pixmap_width = scaled_pixmap.width()
-        displayed_pixmap_height = scaled_pixmap.height()
-
-        # Calculate margins (offsets)
-        x_offset_label = (label_width - displayed_pixmap_width) / 2
-        y_offset_label = (label_height - displayed_pixmap_height) / 2
-
-        # Compute scale factors from image coordinates to label coordinates
-        scale_x = displayed_pixmap_width / display_width
-        scale_y = displayed_pixmap_height / display_height
-
-        # Store transformation parameters
-        self.scale_x = scale_x
-        self.scale_y = scale_y
-        self.x_offset_label = x_offset_label
-        self.y_offset_label = y_offset_label
-        self.x_offset_image = self.x_offset
-        self.y_offset_image = self.y_offset
-
-        # Set transformation parameters in image label
-        self.image_label.set_transformation_params(scale_x, scale_y, x_offset_label, y_offset_label,
-                                                   self.x_offset_image, self.y_offset_image)
-
-        # Set the pixmap to the image_label
-        self.image_label.setPixmap(scaled_pixmap)
+        # Show the visible tiles of the pyramid level closest to the scale; tiles that are
+        # already shown are kept, so panning only adds the newly exposed ones
+        scale = self.view_scale()
+        level = self.image_source.level_for_zoom(scale)
+        level_height, level_width = self.image_source.level_shape(level)
+        tile_size = self.image_source.tile_size
+        covered = tile_size * 2 ** level  # Image pixels covered by a tile
+        columns = range(self.x_offset // covered,
+                        min((self.x_offset + display_width) // covered, (level_width - 1) // tile_size) + 1)
+        rows = range(self.y_offset // covered,
+                     min((self.y_offset + display_height) // covered, (level_height - 1) // tile_size) + 1)
+        with timers.stage('tiles'):
+            self.image_view.show_tiles(level, [(column, row) for row in rows for column in columns], tile_size,
+                                       self.tile_pixmap)
+
+        # Zoom and panning are only the view transform
+        with timers.stage('show'):
+            self.image_view.show_region(self.x_offset, self.y_offset, display_width, display_height, scale)
         self.update_mini_map()
-
-    def update_mini_map(self):
-        """Update the mini-map to reflect the current view."""
-        if self.image_path is None or self.full_image is None:
-            return
-
-        # Create a thumbnail for the mini-map
-        thumb = cv2.resize(self.full_image, (300, 300))
-        thumb = cv2.cvtColor(thumb, cv2.COLOR_BGR2RGB)
-
-        qthumb = QImage(thumb.data, thumb.shape[1], thumb.shape[0], thumb.strides[0], QImage.Format_RGB888)
-        pixmap_thumb = QPixmap.fromImage(qthumb)
+        self.update_image_state(self.image_path, viewport=[self.x_offset, self.y_offset, self.zoom_factor])
+
+    def tile_pixmap(self, level, tile_x, tile_y):
+        """Return a tile of a pyramid level as a pixmap, converting it only on a cache miss."""
+        key = (level, tile_x, tile_y)
+        pixmap = self.tile_cache.get(key)
+        if pixmap is None:
+            with timers.stage('read tile'):
+                tile = self.image_source.tile(tile_x, tile_y, level)
+            # The tile is uploaded straight from its BGR buffer, without a converted copy
+            with timers.stage('upload tile'):
+                pixmap = QPixmap.fromImage(bgr_qimage(tile))
+            self.tile_cache.put(key, pixmap)
+        return pixmap
+
+    def build_mini_map(self):
+        """Build the mini-map thumbnail and viewport rectangle for the opened image."""
+        # Create the thumbnail once, the viewport rectangle is moved by update_mini_map
+        thumb = self.thumbnail_store.get(self.image_path)
+        if thumb is None:
+            with timers.stage('mini-map thumbnail'):
+                thumb = self.image_source.thumbnail(self.thumbnail_store.max_size)
+            # Keep it unless it was upscaled from a small preview
+            source = self.image_source
+            decoded_size = max(source.level_shape(source.base_level))
+            if not source.is_preview or decoded_size >= self.thumbnail_store.max_size:
+                self.thumbnail_store.put(self.image_path, thumb)
+        pixmap_thumb = QPixmap.fromImage(bgr_qimage(thumb))
         self.scene.clear()
         self.scene.addPixmap(pixmap_thumb)
+        self.scene.setSceneRect(0, 0, pixmap_thumb.width(), pixmap_thumb.height())
+        self.mini_map_scale = pixmap_thumb.width() / self.image_size[1]
 
-        scale_w = 300 / self.image_size[1]
-        scale_h = 300 / self.image_size[0]
+        # Add a rectangle to show the visible portion
+        self.rect_cursor = self.scene.addRect(0, 0, 0, 0, pen=QPen(QColor("red")))
 
-        # Calculate the size of the display area in terms of the original image
-        label_width = self.image_label.width()
-        label_height = self.image_label.height()
-        display_width = int(label_width / self.zoom_factor)
-        display_height = int(label_height / self.zoom_factor)
+    def update_mini_map(self):
+        """Move the mini-map rectangle to reflect the current view."""
+        if self.image_path is None or self.rect_cursor is None:
+            return
 
-        rect_w = display_width * scale_w
-        rect_h = display_height * scale_h
+        # Calculate the size of the display area in terms of the original image
+        display_width, display_height = self.display_size()
 
-        # Add a rectangle to show the visible portion
-        self.rect_cursor = self.scene.addRect(self.x_offset * scale_w, self.y_offset * scale_h, rect_w, rect_h,
-                                              pen=QPen(QColor("red")))
+        scale = self.mini_map_scale
+        with timers.stage('mini-map'):
+            self.rect_cursor.setRect(self.x_offset * scale, self.y_offset * scale,
+                                     display_width * scale, display_height * scale)
 
     def handle_mini_map_click(self, event):
         """Handle mouse clicks on the mini-map to navigate the image."""
-        if self.image_path is None:
+        if self.image_source is None:
             return
 
         # Calculate the position in the main image based on the click on the mini-map
-        pos = event.pos()
+        pos = self.map_view.mapToScene(event.pos())
         map_x = pos.x()
         map_y = pos.y()
 
         # Convert mini-map coordinates to real image coordinates
-        scale_w = self.image_size[1] / 300
-        scale_h = self.image_size[0] / 300
+        scale_w = 1 / self.mini_map_scale
+        scale_h = 1 / self.mini_map_scale
 
         # Calculate the size of the display area in terms of the original image
-        label_width = self.image_label.width()
-        label_height = self.image_label.height()
-        display_width = int(label_width / self.zoom_factor)
-        display_height = int(label_height / self.zoom_factor)
+        display_width, display_height = self.display_size()
 
         self.x_offset = int(map_x * scale_w) - display_width // 2
         self.y_offset = int(map_y * scale_h) - display_height // 2
@@ -780,14 +1389,13 @@ class ImageCropper(QMainWindow):
         self.x_offset = max(0, min(self.x_offset, self.image_size[1] - display_width))
         self.y_offset = max(0, min(self.y_offset, self.image_size[0] - display_height))
 
-        self.display_image()
+        self.schedule_render()
 
     def keyPressEvent(self, event):
         """Handle key press events for navigation."""
-        label_width = self.image_label.width()
-        label_height = self.image_label.height()
-        display_width = int(label_width / self.zoom_factor)
-        display_height = int(label_height / self.zoom_factor)
+        if self.image_size is None:
+            return
+        display_width, display_height = self.display_size()
 
         step = int(100 / self.zoom_factor)
         if event.modifiers() & Qt.ControlModifier:
@@ -802,82 +1410,162 @@ class ImageCropper(QMainWindow):
         elif event.key() == Qt.Key_Down:
             self.y_offset = min(self.image_size[0] - display_height, self.y_offset + step)
 
-        self.display_image()  # Update the image display after moving
+        self.schedule_render()  # Update the image display after moving
 
     def handle_mouse_click(self, x, y):
         """Handle mouse clicks on the image to perform cropping."""
-        if self.image_label.pixmap() and self.scale_x and self.scale_y:
-            # Adjust for label offsets
-            label_x_adj = x - self.x_offset_label
-            label_y_adj = y - self.y_offset_label
-
-            # Check if the mouse is within the pixmap area
-            pixmap_width = self.image_label.pixmap().width()
-            pixmap_height = self.image_label.pixmap().height()
-            if 0 <= label_x_adj <= pixmap_width and 0 <= label_y_adj <= pixmap_height:
-                # Map mouse position to image coordinates
-                image_x = label_x_adj / self.scale_x + self.x_offset_image
-                image_y = label_y_adj / self.scale_y + self.y_offset_image
-
-                # Crop at the calculated image coordinates
-                self.crop_at_position(int(image_x), int(image_y))
+        # Crop at the clicked image coordinates
+        self.crop_at_position(x, y)
+
+    def handle_mouse_move(self, x, y):
+        """Preview the filters on the crop under the cursor."""
+        if not self.selected_filters:
+            return
+        self.preview_position = x, y
+        self.request_filter_preview()
+
+    def request_filter_preview(self):
+        """Start computing the preview for the latest position, unless one is running."""
+        if self.preview_running or self.preview_position is None or self.image_source is None:
+            return
+        if self.image_source.is_preview:
+            # Crops are only read from the full resolution image
+            return
+        x, y = self.preview_position
+        self.preview_position = None
+        self.preview_running = True
+        future = self.preview_executor.submit(self.compute_filter_preview, self.image_source, self.image_path,
+                                              self.filter_chain, x, y, self.crop_size)
+        future.add_done_callback(self.preview_ready.emit)
+
+    def compute_filter_preview(self, image_source, image_path, filter_chain, x, y, crop_size):
+        """Filter the crop centred on (x, y), reusing cached chain prefixes (preview thread)."""
+        x_start, y_start, x_end, y_end = crop_bounds(x, y, crop_size, image_source.shape)
+        crop = image_source.read_region(x_start, y_start, x_end - x_start, y_end - y_start)
+        if crop.size == 0:
+            return None
+        crop_key = (image_path, x_start, y_start, x_end, y_end)
+        return filter_chain.apply_cached(crop, crop_key, self.preview_cache), (x, y)
+
+    def show_filter_preview(self, future):
+        """Show a finished preview and start the next one if the cursor moved meanwhile."""
+        self.preview_running = False
+        error = future.exception()
+        if error is not None:
+            self.preview_label.setText(f"Preview failed:\n{error}")
+        elif future.result() is not None:
+            preview, position = future.result()
+            if preview.ndim == 2:
+                preview = np.ascontiguousarray(preview)
+                qimg = QImage(preview.data, preview.shape[1], preview.shape[0], preview.strides[0],
+                              QImage.Format_Grayscale8)
+            else:
+                qimg = bgr_qimage(preview)
+            pixmap = QPixmap.fromImage(qimg)
+            self.preview_label.setPixmap(pixmap.scaled(self.preview_label.size(), Qt.KeepAspectRatio,
+                                                       Qt.SmoothTransformation))
+            # Keep the position so a filter change can refresh the preview
+            self.last_preview_position = position
+        self.request_filter_preview()
 
     def crop_at_position(self, x, y):
         """Crop the image at the specified position."""
         if self.crop_folder is None:
             QMessageBox.warning(self, "Error", "Destination folder not set.")
             return
+        if self.image_source is None or self.image_source.is_preview:
+            self.statusBar().showMessage("Full resolution is still loading, crop again in a moment.", 3000)
+            return
+
+        crop_name = crop_file_name(self.image_path, x, y, self.crop_encoder.extension)
+        crop_path = os.path.join(self.crop_folder, crop_name)
 
-        crop_half_size = self.crop_size // 2
-        x_start = max(0, int(x - crop_half_size))
-        y_start = max(0, int(y - crop_half_size))
-        x_end = min(self.image_size[1], int(x + crop_half_size))
-        y_end = min(self.image_size[0], int(y + crop_half_size))
+        # Skip a crop that is queued or was already made the same way, before any work is done
+        manifest = self.open_crop_manifest()
+        key = CropManifest.key(self.image_key, x, y, self.crop_size, chain_description(self.filter_chain),
+                               self.crop_encoder)
+        sink = self.crop_sink()
+        exists = crop_name in sink if sink is not None else os.path.exists(crop_path)
+        # A file that was last written by another crop (e.g. with other filters) is replaced
+        if crop_path in self.manifest_entries or (manifest.key_of(crop_name) == key and exists):
+            self.statusBar().showMessage(f"Already cropped: {crop_name}", 3000)
+            return
+
+        x_start, y_start, x_end, y_end = crop_bounds(x, y, self.crop_size, self.image_size)
 
         # Ensure the crop size is correct
         crop_width = x_end - x_start
         crop_height = y_end - y_start
 
-        # Extract the crop area from the stored full image
-        crop = self.full_image[y_start:y_end, x_start:x_end]
+        # Read the crop area from the image tiles
+        with timers.stage('crop read'):
+            crop = self.image_source.read_region(x_start, y_start, crop_width, crop_height)
 
         if crop is None or crop.size == 0:
             QMessageBox.warning(self, "Error", "Unable to extract the crop.")
             return
 
-        # Apply filters in order
-        for filter in self.selected_filters:
-            crop = filter.apply(crop)
+        # Recorded in the manifest once written
+        self.manifest_entries[crop_path] = (manifest, manifest.entry(key, crop_name, self.image_path, crop))
 
-        base_name = os.path.basename(self.image_path)
-        name, ext = os.path.splitext(base_name)
+        # Filter and write the crop on a worker thread
+        self.crop_queue.submit(crop, self.filter_chain, crop_path, self.crop_encoder, sink)
 
-        crop_name = f"{name}_crop_{x}_{y}.png"
-        crop_path = os.path.join(self.crop_folder, crop_name)
+    def update_crop_status(self, pending, saved, failed):
+        """Show the crop queue state in the status bar."""
+        text = f"Crops: {pending} queued, {saved} saved"
+        if failed:
+            text += f", {failed} failed"
+        self.crop_status_label.setText(text)
 
-        # todo optimize this save the crop
-        if len(crop.shape) == 2:
-            # Grayscale or single-channel image
-            cv2.imwrite(crop_path, crop)
-        else:
-            # Color image
-            cv2.imwrite(crop_path, crop)
+    def handle_crop_saved(self, crop_path):
+        """Record a written crop."""
+        manifest, entry = self.manifest_entries.pop(crop_path)
+        manifest.add(entry)
 
-        # Update save time and crop folder in recent files
+        # Update save time and crop folder in recent files (written by the next flush)
         from datetime import datetime
+        image_path = entry['image']
         for file_info in self.recent_files:
-            if file_info['path'] == self.image_path:
+            if file_info['path'] == image_path:
                 file_info['save_time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                file_info['crop_folder'] = self.crop_folder  # Update crop_folder
+                file_info['crop_folder'] = manifest.folder  # Update crop_folder
                 break
-        # Save in settings
-        self.settings.setValue('recent_files', self.recent_files)
-
-        QMessageBox.information(self, "Crop", f"Crop saved as: {crop_name}")
+        self.session_state.set('recent_files', self.recent_files)
+        self.update_image_state(image_path, crops=self.image_state(image_path).get('crops', 0) + 1)
+
+        self.statusBar().showMessage(f"Crop saved as: {os.path.basename(crop_path)}", 3000)
+
+    def handle_crop_failed(self, crop_path, error_message):
+        """Report a crop that could not be written."""
+        self.manifest_entries.pop(crop_path, None)
+        self.statusBar().showMessage(f"Crop failed: {error_message}", 10000)
+
+    def closeEvent(self, event):
+        """Finish writing the queued crops before closing."""
+        self.crop_queue.shutdown()
+        if self.grid_job is not None:
+            # Let the running chunks finish writing their crops
+            self.grid_job.cancel()
+            self.grid_job.executor.shutdown(wait=True)
+        # Deliver the finished chunks (whose crops may still go to the archive) and record
+        # the crops whose completion has not been delivered yet
+        QApplication.sendPostedEvents()
+        self.close_crop_archive()
+        for manifest in self.crop_manifests.values():
+            manifest.close()
+        self.session_state.close()
+        self.preview_executor.shutdown(wait=True)
+        # A decode in progress cannot be interrupted; do not wait for it
+        self.load_executor.shutdown(wait=False, cancel_futures=True)
+        self.prefetch_executor.shutdown(wait=False, cancel_futures=True)
+        shutdown_code_filter_pool()
+        timers.stop_trace()
+        super().closeEvent(event)
 
     def resizeEvent(self, event):
         """Adjust the image display when the window is resized."""
-        self.display_image()
+        self.schedule_render()
         super().resizeEvent(event)
 
 
@@ -894,17 +1582,7 @@ class FilterDialog(QDialog):
             selected_filters = []
 
         # Available filters
-        self.available_filters = [
-            GrayscaleFilter(),
-            BlurFilter(),
-            CannyEdgeFilter(),
-            ThresholdFilter(),
-            LaplacianFilter(),
-            SobelFilter(),
-            ErosionFilter(),
-            DilationFilter(),
-            # Add more default filters as needed
-        ]
+        self.available_filters = [filter_class() for filter_class in BUILTIN_FILTERS]
 
         # Create the layout
         layout = QVBoxLayout(self)
@@ -1012,21 +1690,8 @@ class FilterDialog(QDialog):
 
     def create_filter_from_code(self, name, code):
         """Create a custom filter from the provided code snippet."""
-        # Define a local dictionary for the code execution
-        local_dict = {}
-        exec(code, {'np': np, 'cv2': cv2}, local_dict)
-        # The code should define an 'apply' function
-        if 'apply' not in local_dict:
-            raise ValueError("Code must define an 'apply' function")
-        apply_func = local_dict['apply']
-        # Create a new Filter subclass
-        class CustomFilter(Filter):
-            def __init__(self):
-                super().__init__(name, icon='icons/filter-outline.svg')
-
-            def apply(self, image):
-                return apply_func(image)
-        return CustomFilter()
+        # The snippet runs in the custom filter worker processes, not in the viewer
+        return CodeFilter(name, code)
 
     def get_selected_filters(self):
         """Retrieve the list of selected filters."""
@@ -1232,14 +1897,144 @@ class CodeSnippetDialog(QDialog):
 
 
 
+class CropFormatDialog(QDialog):
+    """Dialog for choosing the crop file format, with a measurement of every format."""
+    def __init__(self, encoder, use_archive, sample_crops, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Crop Format")
+        self.setWindowIcon(QIcon('icons/file-edit-outline.svg'))
+        self.sample_crops = sample_crops  # Returns the crops to measure on
+
+        layout = QVBoxLayout(self)
+        form_layout = QFormLayout()
+        self.format_combo = QComboBox()
+        self.format_combo.addItems(list(CROP_FORMATS))
+        self.format_combo.setCurrentText(encoder.format)
+        self.format_combo.currentTextChanged.connect(self.update_level_range)
+        form_layout.addRow("Format:", self.format_combo)
+        self.level_spin = QSpinBox()
+        form_layout.addRow("Compression / quality:", self.level_spin)
+        layout.addLayout(form_layout)
+        self.update_level_range(encoder.format)
+        if encoder.level is not None:
+            self.level_spin.setValue(encoder.level)
+        self.archive_check = QCheckBox("Append crops to archive shards (crops-*.tar and index.jsonl)")
+        self.archive_check.setToolTip("Write a few large tar files instead of one file per crop")
+        self.archive_check.setChecked(use_archive)
+        layout.addWidget(self.archive_check)
+
+        # Encode time and size of every format on crops of the opened image
+        self.results_label = QLabel("Measure the formats on crops of the opened image.")
+        self.results_label.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        layout.addWidget(self.results_label)
+        measure_button = QPushButton("Measure")
+        measure_button.setIcon(QIcon('icons/timeline-plus-outline.svg'))
+        measure_button.clicked.connect(self.measure)
+        layout.addWidget(measure_button)
+
+        button_layout = QHBoxLayout()
+        ok_button = QPushButton("OK")
+        ok_button.clicked.connect(self.accept)
+        button_layout.addWidget(ok_button)
+        cancel_button = QPushButton("Cancel")
+        cancel_button.clicked.connect(self.reject)
+        button_layout.addWidget(cancel_button)
+        layout.addLayout(button_layout)
+
+    def update_level_range(self, format):
+        """Adapt the level box to the selected format."""
+        _, _, default_level, level_range = CROP_FORMATS[format]
+        self.level_spin.setEnabled(level_range is not None)
+        if level_range is None:
+            self.level_spin.setRange(0, 0)
+        else:
+            self.level_spin.setRange(*level_range)
+            self.level_spin.setValue(default_level)
+        tooltips = {
+            'PNG': "Compression level, 0 is fastest and 9 smallest",
+            'JPEG': "Quality, higher is larger",
+            'WebP': "Quality, above 100 is lossless",
+        }
+        self.level_spin.setToolTip(tooltips.get(format, "No options, crops are stored uncompressed"))
+
+    def measure(self):
+        """Encode sample crops with every format and show the time and size per crop."""
+        crops = self.sample_crops()
+        if not crops:
+            self.results_label.setText("Open an image (at full resolution) to measure the formats.")
+            return
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            results = compare_encoders(crops)
+        finally:
+            QApplication.restoreOverrideCursor()
+        rows = "".join(f"<tr><td>{encoder}</td><td align='right'>{milliseconds:.2f}</td>"
+                       f"<td align='right'>{size / 1024:.1f}</td></tr>"
+                       for encoder, milliseconds, size in results)
+        self.results_label.setText(f"<table cellspacing='6'><tr><th>Format</th><th>ms/crop</th>"
+                                   f"<th>KB/crop</th></tr>{rows}</table>")
+
+    def get_encoder(self):
+        """Return the selected encoder."""
+        return CropEncoder(self.format_combo.currentText(), self.level_spin.value())
+
+
+class GridCropDialog(QDialog):
+    """Dialog for the stride and area of a grid crop."""
+    def __init__(self, crop_size, window_count, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Grid Crop")
+        self.setWindowIcon(QIcon('icons/crop.svg'))
+        self.crop_size = crop_size
+        self.window_count = window_count  # (stride, visible_only) -> number of windows
+
+        layout = QVBoxLayout(self)
+        form_layout = QFormLayout()
+        self.stride_spin = QSpinBox()
+        self.stride_spin.setRange(1, 100000)
+        self.stride_spin.setValue(crop_size)
+        self.stride_spin.setToolTip(f"Distance between windows; {crop_size} tiles the image without overlap")
+        self.stride_spin.valueChanged.connect(self.update_count)
+        form_layout.addRow("Stride (pixels):", self.stride_spin)
+        self.visible_check = QCheckBox("Visible area only")
+        self.visible_check.toggled.connect(self.update_count)
+        form_layout.addRow(self.visible_check)
+        layout.addLayout(form_layout)
+        self.count_label = QLabel()
+        layout.addWidget(self.count_label)
+        self.update_count()
+
+        button_layout = QHBoxLayout()
+        ok_button = QPushButton("Crop")
+        ok_button.clicked.connect(self.accept)
+        button_layout.addWidget(ok_button)
+        cancel_button = QPushButton("Cancel")
+        cancel_button.clicked.connect(self.reject)
+        button_layout.addWidget(cancel_button)
+        layout.addLayout(button_layout)
+
+    def update_count(self):
+        """Show how many crops the grid makes."""
+        count = self.window_count(self.stride_spin.value(), self.visible_check.isChecked())
+        self.count_label.setText(f"{count} crops of {self.crop_size} x {self.crop_size} pixels")
+
+
 class StartupDialog(QDialog):
     """Startup dialog to open a new or recent image."""
-    def __init__(self, recent_files, parent=None):
+    thumbnail_ready = pyqtSignal(object)  # Future of a (path, thumbnail) job
+
+    def __init__(self, recent_files, thumbnail_store=None, session_state=None, parent=None):
         super().__init__(parent)
         self.setWindowTitle('ImageCropper - Start')
         self.setWindowIcon(QIcon('logoImageCropper.jfif'))
         self.recent_files = recent_files
+        self.session_state = session_state  # Where the recent files are stored
         self.selected_file = None
+        self.thumbnail_store = thumbnail_store
+        self.items = {}  # Image path -> list item
+        # Missing thumbnails are made in the background, the list shows right away
+        self.thumbnail_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='thumbnails')
+        self.thumbnail_ready.connect(self.show_thumbnail)
 
         # Set up the layout
         layout = QVBoxLayout()
@@ -1260,6 +2055,7 @@ class StartupDialog(QDialog):
         # If there are recent files, show them in a list
         if self.recent_files:
             self.list_widget = QListWidget()
+            self.list_widget.setIconSize(QSize(64, 64))
             for file_info in self.recent_files:
                 # file_info is a dictionary with 'path', 'open_time', 'save_time'
                 item = QListWidgetItem(QIcon('icons/image-outline.svg'),
@@ -1268,6 +2064,10 @@ class StartupDialog(QDialog):
                 item.setToolTip(
                     f"Opened: {file_info['open_time']}\nLast save: {file_info['save_time']}")
                 self.list_widget.addItem(item)
+                self.items[file_info['path']] = item
+                if self.thumbnail_store is not None:
+                    future = self.thumbnail_executor.submit(self.load_thumbnail, file_info['path'])
+                    future.add_done_callback(self.thumbnail_ready.emit)
             self.list_widget.itemClicked.connect(self.select_recent_file)
             layout.addWidget(self.list_widget)
 
@@ -1279,6 +2079,28 @@ class StartupDialog(QDialog):
 
         self.setLayout(layout)
 
+    def load_thumbnail(self, path):
+        """Return the stored thumbnail of an image, making it if needed (thumbnail thread)."""
+        thumb = self.thumbnail_store.get(path)
+        if thumb is None:
+            thumb = self.thumbnail_store.create(path)
+        return path, thumb
+
+    def show_thumbnail(self, future):
+        """Use a loaded thumbnail as the icon of its recent file."""
+        if future.exception() is not None:
+            # Moved or unreadable file, keep the generic icon
+            return
+        path, thumb = future.result()
+        item = self.items.get(path)
+        if item is not None:
+            item.setIcon(QIcon(QPixmap.fromImage(bgr_qimage(thumb))))
+
+    def done(self, result):
+        """Stop making thumbnails once the dialog closes."""
+        self.thumbnail_executor.shutdown(wait=False, cancel_futures=True)
+        super().done(result)
+
     def open_new_image(self):
         """Set to open a new image."""
         self.selected_file = 'new'
@@ -1296,11 +2118,13 @@ class StartupDialog(QDialog):
                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if reply == QMessageBox.Yes:
             self.recent_files.clear()
-            # Update the settings to clear the stored recent files
-            settings = QSettings('YourCompany', 'ImageCropper')
-            settings.setValue('recent_files', self.recent_files)
+            # Clear the stored recent files
+            if self.session_state is not None:
+                self.session_state.set('recent_files', self.recent_files)
+                self.session_state.flush()
             # Remove the list widget from the layout
             self.list_widget.clear()
+            self.items.clear()
             # Hide the list widget and the clear history button
             self.list_widget.hide()
             self.sender().hide()  # Hide the button that called this method
@@ -1313,17 +2137,14 @@ if __name__ == "__main__":
     # Process events
     app.processEvents()
 
-    # Initialize settings to get recent files
-    settings = QSettings('YourCompany', 'ImageCropper')
-    recent_files = settings.value('recent_files', [], type=list)
-
     # Create the main application window but do not show it yet
     mainWin = ImageCropper()
     mainWin.hide()
+    recent_files = mainWin.recent_files
 
     # Show the startup dialog if there are recent files
     if recent_files:
-        startup_dialog = StartupDialog(recent_files)
+        startup_dialog = StartupDialog(recent_files, mainWin.thumbnail_store, mainWin.session_state)
         if startup_dialog.exec_() == QDialog.Accepted:
             if startup_dialog.selected_file == 'new':
                 # Open a new image
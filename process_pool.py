@@ -0,0 +1,11 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+def spawn_executor(max_workers=None):
+    """Return a process pool whose workers are spawned rather than forked.
+
+    Spawned workers start from a fresh interpreter and do not inherit the state of the
+    GUI process; forking a process running Qt is unsafe.
+    """
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
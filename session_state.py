@@ -0,0 +1,82 @@
+import json
+import os
+import tempfile
+
+from jsonl import iter_records, open_for_append
+
+
+class SessionState:
+    """Key/value session state kept in memory and persisted through an append-only journal.
+
+    set() only marks a key as changed; flush() appends the changed keys to
+    ``session.jsonl`` in one write, so frequent changes (a crop per click) cost no
+    disk I/O. Call flush() on a timer and at exit: a crash loses at most the changes
+    since the last flush. Loading reads the ``session.json`` snapshot and replays the
+    journal; once the journal grows past ``max_journal_records`` it is folded into a
+    new snapshot.
+
+    Values must be JSON serializable and are serialized when flushed.
+    """
+    def __init__(self, folder, max_journal_records=1000):
+        self.folder = folder
+        self.max_journal_records = max_journal_records
+        self.snapshot_path = os.path.join(folder, 'session.json')
+        self.journal_path = os.path.join(folder, 'session.jsonl')
+        os.makedirs(folder, exist_ok=True)
+        self._values = {}
+        self._changed = set()
+        self._journal_records = 0
+
+        try:
+            with open(self.snapshot_path) as f:
+                self._values = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+        for record in iter_records(self.journal_path):
+            self._values[record['key']] = record['value']
+            self._journal_records += 1
+        self._journal = open_for_append(self.journal_path)
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def get(self, key, default=None):
+        """Return the value of a key."""
+        return self._values.get(key, default)
+
+    def set(self, key, value):
+        """Change the value of a key; it is written by the next flush."""
+        self._values[key] = value
+        self._changed.add(key)
+
+    def flush(self):
+        """Append the changed keys to the journal and sync it to disk."""
+        if not self._changed:
+            return
+        records = ''.join(json.dumps({'key': key, 'value': self._values[key]}) + '\n'
+                          for key in sorted(self._changed))
+        self._journal.write(records)
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._journal_records += len(self._changed)
+        self._changed.clear()
+        if self._journal_records > self.max_journal_records:
+            self.compact()
+
+    def compact(self):
+        """Write every value to a new snapshot and empty the journal."""
+        self._changed.clear()
+        fd, temp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self._values, f)
+            f.flush()
+            os.fsync(f.fileno())
+        # The journal is only emptied once the snapshot holding its records is in place
+        os.replace(temp_path, self.snapshot_path)
+        self._journal.truncate(0)
+        self._journal_records = 0
+
+    def close(self):
+        """Flush the changes and close the journal."""
+        self.flush()
+        self._journal.close()
@@ -0,0 +1,82 @@
+import os
+import tempfile
+
+import cv2
+import numpy as np
+
+from decode_cache import file_key
+from image_source import ImageSource
+
+
+class ThumbnailStore:
+    """Small persistent store of image thumbnails, as JPEG files keyed by file identity.
+
+    Thumbnails are keyed like the decode cache (path, size and modification time), so an
+    edited image gets a new one. Only the ``max_entries`` most recently used are kept.
+    Thumbnails fit in ``max_size`` x ``max_size`` pixels.
+    """
+    def __init__(self, root, max_size=300, max_entries=500):
+        self.root = root
+        self.max_size = max_size
+        self.max_entries = max_entries
+        os.makedirs(root, exist_ok=True)
+
+    def _thumbnail_path(self, path):
+        return os.path.join(self.root, file_key(path) + '.jpg')
+
+    def get(self, path):
+        """Return the stored (height, width, 3) BGR thumbnail of an image, or None."""
+        try:
+            thumbnail_path = self._thumbnail_path(path)
+            # Read through NumPy, cv2.imread does not handle non-ASCII paths on Windows
+            data = np.fromfile(thumbnail_path, dtype=np.uint8)
+        except OSError:
+            return None
+        thumb = cv2.imdecode(data, cv2.IMREAD_COLOR)
+        if thumb is not None:
+            # The file time orders the thumbnails for eviction
+            os.utime(thumbnail_path)
+        return thumb
+
+    def put(self, path, thumb):
+        """Store the thumbnail of an image, replacing any previous one."""
+        try:
+            thumbnail_path = self._thumbnail_path(path)
+        except OSError:
+            return
+        ok, encoded = cv2.imencode('.jpg', thumb, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        if not ok:
+            return
+        # Write under a temporary name, so readers never see a partial file
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(encoded.tobytes())
+        os.replace(temp_path, thumbnail_path)
+        self.prune()
+
+    def create(self, path):
+        """Make, store and return the thumbnail of an image, from a reduced decode when possible."""
+        reduction = 1 if path.lower().endswith('.npy') else 8
+        source = ImageSource(path, reduction=reduction)
+        if source.is_preview and max(source.level_shape(source.base_level)) < self.max_size:
+            # Small image: a full decode is cheap and avoids upscaling the preview
+            source.close()
+            source = ImageSource(path)
+        try:
+            thumb = source.thumbnail(self.max_size)
+        finally:
+            source.close()
+        self.put(path, thumb)
+        return thumb
+
+    def prune(self):
+        """Remove the least recently used thumbnails beyond max_entries."""
+        entries = [entry for entry in os.scandir(self.root) if entry.name.endswith('.jpg')]
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
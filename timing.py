@@ -0,0 +1,87 @@
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class StageTimer:
+    """Switchable timers for named stages of the render and crop paths.
+
+    Keeps the last ``window`` durations of every stage for rolling percentiles, and can
+    append every measurement to a JSON-lines trace file. When disabled, timing a stage
+    costs a single attribute check.
+    """
+    def __init__(self, window=200):
+        self.enabled = False
+        self.window = window
+        self._samples = {}  # Stage name -> recent durations in ms
+        self._trace = None
+        self._lock = threading.Lock()  # Stages are timed on the GUI and crop worker threads
+
+    @contextmanager
+    def stage(self, name):
+        """Time the body of a with statement as the given stage."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000)
+
+    def record(self, name, duration_ms):
+        """Record a stage duration in milliseconds."""
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.window)
+            samples.append(duration_ms)
+            if self._trace is not None:
+                self._trace.write(json.dumps({
+                    'time': time.time(),
+                    'stage': name,
+                    'ms': round(duration_ms, 3),
+                    'thread': threading.current_thread().name,
+                }) + '\n')
+
+    def percentiles(self, name, percents=(50, 95)):
+        """Return the given percentiles of the recent durations of a stage, or None."""
+        with self._lock:
+            samples = sorted(self._samples.get(name, ()))
+        if not samples:
+            return None
+        return [samples[min(len(samples) - 1, len(samples) * percent // 100)] for percent in percents]
+
+    def summary(self):
+        """One-line p50/p95 summary of every timed stage."""
+        with self._lock:
+            names = list(self._samples)
+        parts = []
+        for name in names:
+            p50, p95 = self.percentiles(name)
+            parts.append(f"{name} {p50:.1f}/{p95:.1f}")
+        return "p50/p95 ms: " + ", ".join(parts) if parts else ""
+
+    def reset(self):
+        """Forget the recorded durations."""
+        with self._lock:
+            self._samples.clear()
+
+    def start_trace(self, path):
+        """Append every following measurement to a JSON-lines file."""
+        self.stop_trace()
+        with self._lock:
+            self._trace = open(path, 'a')
+
+    def stop_trace(self):
+        """Stop writing the trace file."""
+        with self._lock:
+            if self._trace is not None:
+                self._trace.close()
+                self._trace = None
+
+
+# Shared by the viewer and the crop workers
+timers = StageTimer()